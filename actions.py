@@ -59,6 +59,9 @@ class TakeStairsAction(Action):
             
             
             self.entity.place(target_stair.dest_x, target_stair.dest_y, dest_level)
+            self.engine.world_level = dest_level
+            self.engine.world_map.evict_levels() #the level just left can be moved out of memory now
+            self.engine.world_map.pregenerate_stair_destinations(dest_level)
         
 class ActionWithDirection(Action):
     def __init__(self, entity: Actor, dx: int, dy: int):
@@ -102,7 +105,7 @@ class MovementAction(ActionWithDirection):
             #Destination is out of bounds
             raise exceptions.Impossible("That direction doesnt exist.")
         
-        if not self.engine.world_level.tiles["walkable"][dest_x, dest_y]:
+        if not self.engine.world_level.walkable[dest_x, dest_y]:
             #Destination is blocked by a tile
             raise exceptions.Impossible("That direction is blocked by a tile.")
         if self.engine.world_level.get_blocking_entity_at_location(dest_x, dest_y):
@@ -0,0 +1,31 @@
+#camera for drawing levels bigger than the screen, only the viewport around what it follows is drawn
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+
+class Camera:
+    def __init__(self, width: int, height: int):
+        self.width = width #size of the viewport on the console, in tiles
+        self.height = height
+        self.x = 0 #level position of the top left tile of the viewport
+        self.y = 0
+
+    def follow(self, x: int, y: int, level_width: int, level_height: int) -> None:
+        #Center the viewport on x, y without showing past the edges of the level
+        self.x = min(max(x - self.width // 2, 0), max(level_width - self.width, 0))
+        self.y = min(max(y - self.height // 2, 0), max(level_height - self.height, 0))
+
+    def bounds(self, level_width: int, level_height: int) -> Tuple[slice, slice]:
+        #Return the part of the level inside the viewport, smaller than the viewport for small levels
+        return (
+            slice(self.x, min(self.x + self.width, level_width)),
+            slice(self.y, min(self.y + self.height, level_height)),
+        )
+
+    def to_level(self, screen_x: int, screen_y: int) -> Optional[Tuple[int, int]]:
+        #Return the level position under a console tile, None if the tile is outside the viewport
+        if 0 <= screen_x < self.width and 0 <= screen_y < self.height:
+            return screen_x + self.x, screen_y + self.y
+        return None
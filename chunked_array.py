@@ -0,0 +1,323 @@
+#2D array stored as fixed size square chunks that are only allocated when something is written to them
+#
+#used for the per tile arrays of a WorldLevel, so huge levels only cost memory for the parts that differ from
+#the fill value: a chunk that was never written is the fill value, a chunk that was set to one value all over
+#(like a big room of floor) is stored as that single value, and only chunks with mixed contents are dense arrays
+#
+#indexing works like the numpy arrays it replaces for the ways this game uses them:
+#   array[x, y]                         single element
+#   array[x0:x1, y0:y1]                 dense copy of a box (ints can be mixed in, like numpy they drop that axis)
+#   array[xs, ys]                       fancy indexing with integer arrays
+#   array[mask]                         level sized boolean mask
+#   array["field"][...]                 the same on one field of a structured dtype
+#reads always return copies, so in place updates have to be written back, which array[...] |= x already does
+#
+#arrays no bigger than SINGLE_CHUNK_LIMIT on either side (like the default 80x43 level) are one dense chunk,
+#and indexing them goes straight to numpy instead of being split up by chunk
+
+from __future__ import annotations
+
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+#width and height of a chunk in tiles
+CHUNK_SIZE = 32
+#arrays up to this size on both sides are stored as a single dense chunk
+SINGLE_CHUNK_LIMIT = 128
+
+ChunkKey = Tuple[int, int]
+
+
+class ChunkedArray:
+    def __init__(self, shape: Tuple[int, int], dtype, fill_value, chunk_size: Optional[int] = None):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype)
+        if chunk_size is None:
+            chunk_size = max(self.shape) if max(self.shape) <= SINGLE_CHUNK_LIMIT else CHUNK_SIZE
+        self.chunk_size = chunk_size
+        #the whole array is chunk (0, 0), which is always kept dense, see read/write
+        #that chunk is exactly shape instead of padded out to a square, so it costs what a plain array would
+        self.single = chunk_size >= max(self.shape)
+        self.fill_value = np.array(fill_value, dtype=self.dtype)
+        #(chunk x, chunk y): a dense (chunk_size, chunk_size) array, or a 0d array for a chunk of one value
+        #a single chunk array has one chunk of exactly shape
+        #chunks missing from here are fill_value
+        self.chunks: Dict[ChunkKey, np.ndarray] = {}
+
+    def __getstate__(self) -> dict:
+        #the dense chunks are pickled as one array, so save_archive can store them as one buffer
+        #that is big enough to be memory mapped when loading, instead of many small ones in the pickle
+        state = self.__dict__.copy()
+        dense_keys = [key for key, chunk in self.chunks.items() if chunk.ndim]
+        state["chunks"] = {key: chunk for key, chunk in self.chunks.items() if not chunk.ndim}
+        state["dense_keys"] = dense_keys
+        state["dense_chunks"] = None
+        if dense_keys:
+            state["dense_chunks"] = np.asfortranarray(np.stack([self.chunks[key] for key in dense_keys], axis=-1))
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        #saves from before the dense chunks were packed have them all in chunks
+        dense_keys = state.pop("dense_keys", ())
+        dense_chunks = state.pop("dense_chunks", None)
+        self.__dict__.update(state)
+        #chunks are views into the one array, which may be memory mapped from a save
+        for n, key in enumerate(dense_keys):
+            self.chunks[key] = dense_chunks[..., n]
+        if self.single and (0, 0) in self.chunks and self.chunks[0, 0].ndim:
+            #saves from before single chunks were exactly shape have them padded to a square
+            self.chunks[0, 0] = self.chunks[0, 0][: self.shape[0], : self.shape[1]]
+
+    def whole(self) -> np.ndarray:
+        #Return the whole array, writable, only for single chunk arrays
+        return self.dense_chunk((0, 0))
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            return ChunkedField(self, index)
+        return self.read(index)
+
+    def __setitem__(self, index, value) -> None:
+        self.write(index, value)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self.read((slice(None), slice(None)))
+        return array if dtype is None else array.astype(dtype)
+
+    def copy(self) -> ChunkedArray:
+        copied = ChunkedArray(self.shape, self.dtype, self.fill_value, self.chunk_size)
+        copied.chunks = {key: chunk.copy() for key, chunk in self.chunks.items()}
+        return copied
+
+    @property
+    def allocated_bytes(self) -> int:
+        return sum(chunk.nbytes for chunk in self.chunks.values())
+
+    def chunk(self, key: ChunkKey) -> np.ndarray:
+        #Return a chunks contents, a 0d array if the whole chunk is one value
+        return self.chunks.get(key, self.fill_value)
+
+    def dense_chunk(self, key: ChunkKey) -> np.ndarray:
+        #Return a chunk as a dense array that can be written to, allocating it if needed
+        chunk = self.chunks.get(key)
+        if chunk is None or chunk.ndim == 0:
+            value = self.fill_value if chunk is None else chunk
+            shape = self.shape if self.single else (self.chunk_size, self.chunk_size)
+            chunk = self.chunks[key] = np.full(shape, value, dtype=self.dtype, order="F")
+        return chunk
+
+    #indexing
+
+    def read(self, index, field: Optional[str] = None):
+        if self.single:
+            array = self.whole()
+            result = (array[field] if field else array)[index]
+            return result.copy() if isinstance(result, np.ndarray) else result
+        kind, *args = self.normalize(index)
+        if kind == "point":
+            return self.read_point(*args, field)
+        if kind == "points":
+            return self.read_points(*args, field)
+        return self.read_box(*args, field)
+
+    def write(self, index, value, field: Optional[str] = None) -> None:
+        if self.single:
+            array = self.whole()
+            (array[field] if field else array)[index] = value
+            return
+        kind, *args = self.normalize(index)
+        if kind == "point":
+            x, y = args
+            size = self.chunk_size
+            chunk = self.dense_chunk((x // size, y // size))
+            if field:
+                chunk = chunk[field]
+            chunk[x % size, y % size] = value
+        elif kind == "points":
+            self.write_points(*args, value, field)
+        else:
+            self.write_box(*args, value, field)
+
+    def normalize(self, index) -> tuple:
+        #Sort an index into ("point", x, y), ("points", xs, ys) or ("box", x range, y range, dropped axes)
+        width, height = self.shape
+        if index is Ellipsis or isinstance(index, slice):
+            index = (slice(None), slice(None))
+        if isinstance(index, np.ndarray) and index.dtype == bool:
+            return ("points", *np.nonzero(index))
+        if not isinstance(index, tuple) or len(index) != 2:
+            raise IndexError(f"unsupported index for a ChunkedArray: {index!r}")
+
+        i, j = index
+        if isinstance(i, (int, np.integer)) and isinstance(j, (int, np.integer)):
+            return ("point", int(i), int(j))
+        if isinstance(i, (slice, int, np.integer)) and isinstance(j, (slice, int, np.integer)):
+            ranges = []
+            for axis, size in ((i, width), (j, height)):
+                if isinstance(axis, slice):
+                    start, stop, step = axis.indices(size)
+                    if step != 1:
+                        raise IndexError("ChunkedArray slices cant have a step")
+                    ranges.append((start, max(start, stop)))
+                else:
+                    ranges.append((int(axis), int(axis) + 1))
+            dropped = tuple(n for n, axis in enumerate(index) if not isinstance(axis, slice))
+            return ("box", ranges[0], ranges[1], dropped)
+        xs, ys = np.broadcast_arrays(np.asarray(i, dtype=np.intp), np.asarray(j, dtype=np.intp))
+        return ("points", xs, ys)
+
+    def boxes(self, x_range: Tuple[int, int], y_range: Tuple[int, int]) -> Iterator[tuple]:
+        #Yield (chunk key, slices inside the chunk, slices inside the box, covers the whole chunk) for each chunk
+        size = self.chunk_size
+        (x0, x1), (y0, y1) = x_range, y_range
+        for cx in range(x0 // size, -(-x1 // size)):
+            for cy in range(y0 // size, -(-y1 // size)):
+                left, top = cx * size, cy * size
+                lx0, lx1 = max(x0, left) - left, min(x1, left + size) - left
+                ly0, ly1 = max(y0, top) - top, min(y1, top + size) - top
+                #chunks on the far edges only cover up to the edge of the array
+                whole = (
+                    lx0 == 0 and ly0 == 0
+                    and lx1 == min(size, self.shape[0] - left)
+                    and ly1 == min(size, self.shape[1] - top)
+                )
+                yield (
+                    (cx, cy),
+                    (slice(lx0, lx1), slice(ly0, ly1)),
+                    (slice(left + lx0 - x0, left + lx1 - x0), slice(top + ly0 - y0, top + ly1 - y0)),
+                    whole,
+                )
+
+    def read_point(self, x: int, y: int, field: Optional[str]):
+        size = self.chunk_size
+        chunk = self.chunk((x // size, y // size))
+        if field:
+            chunk = chunk[field]
+        if chunk.ndim == 0:
+            return chunk[()]
+        return chunk[x % size, y % size]
+
+    def read_box(self, x_range, y_range, dropped: Tuple[int, ...], field: Optional[str]) -> np.ndarray:
+        dtype = self.dtype[field] if field else self.dtype
+        out = np.empty((x_range[1] - x_range[0], y_range[1] - y_range[0]), dtype=dtype, order="F")
+        for key, inside, outside, _ in self.boxes(x_range, y_range):
+            chunk = self.chunk(key)
+            if field:
+                chunk = chunk[field]
+            out[outside] = chunk if chunk.ndim == 0 else chunk[inside]
+        if dropped:
+            out = out.squeeze(axis=dropped)
+        return out
+
+    def write_box(self, x_range, y_range, dropped: Tuple[int, ...], value, field: Optional[str]) -> None:
+        value = np.asarray(value)
+        if dropped and value.ndim:
+            value = np.expand_dims(value, dropped)
+        one_value = value.ndim == 0
+        for key, inside, outside, whole in self.boxes(x_range, y_range):
+            if whole and not field:
+                #a whole chunk of one value is stored as just the value, even when it came from an array
+                block = value if one_value else value[outside]
+                if one_value or (block == block.flat[0]).all():
+                    if block.flat[0] == self.fill_value:
+                        self.chunks.pop(key, None)
+                    else:
+                        self.chunks[key] = np.array(block.flat[0], dtype=self.dtype)
+                    continue
+            chunk = self.dense_chunk(key)
+            if field:
+                chunk = chunk[field]
+            chunk[inside] = value if one_value else value[outside]
+
+    def group_points(self, xs: np.ndarray, ys: np.ndarray) -> Iterator[Tuple[ChunkKey, np.ndarray]]:
+        #Yield each chunk the points fall in, with a mask of the points inside it
+        size = self.chunk_size
+        chunk_x, chunk_y = xs // size, ys // size
+        keys = chunk_x * (self.shape[1] // size + 1) + chunk_y
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        for n, i in enumerate(first):
+            yield (int(chunk_x.flat[i]), int(chunk_y.flat[i])), inverse.reshape(keys.shape) == n
+
+    def read_points(self, xs: np.ndarray, ys: np.ndarray, field: Optional[str]) -> np.ndarray:
+        dtype = self.dtype[field] if field else self.dtype
+        out = np.empty(xs.shape, dtype=dtype)
+        size = self.chunk_size
+        for key, selected in self.group_points(xs, ys):
+            chunk = self.chunk(key)
+            if field:
+                chunk = chunk[field]
+            out[selected] = chunk if chunk.ndim == 0 else chunk[xs[selected] % size, ys[selected] % size]
+        return out
+
+    def write_points(self, xs: np.ndarray, ys: np.ndarray, value, field: Optional[str]) -> None:
+        value = np.asarray(value)
+        one_value = value.ndim == 0
+        if not one_value:
+            value = np.broadcast_to(value, xs.shape)
+        size = self.chunk_size
+        for key, selected in self.group_points(xs, ys):
+            chunk = self.dense_chunk(key)
+            if field:
+                chunk = chunk[field]
+            chunk[xs[selected] % size, ys[selected] % size] = value if one_value else value[selected]
+
+    def add_at(self, index: Tuple[np.ndarray, np.ndarray], value) -> None:
+        #Unbuffered in place add like np.add.at, repeated points are added to more than once
+        xs, ys = np.broadcast_arrays(np.asarray(index[0], dtype=np.intp), np.asarray(index[1], dtype=np.intp))
+        value = np.broadcast_to(np.asarray(value), xs.shape)
+        if self.single:
+            np.add.at(self.whole(), (xs, ys), value)
+            return
+        size = self.chunk_size
+        for key, selected in self.group_points(xs, ys):
+            np.add.at(self.dense_chunk(key), (xs[selected] % size, ys[selected] % size), value[selected])
+
+    def map(self, table: np.ndarray) -> ChunkedArray:
+        #Return a new array of table[value] for every value, chunks of one value stay one value
+        #used to turn tile ids into masks through a lookup table, so values have to be valid indexes into table
+        mapped = ChunkedArray(self.shape, table.dtype, table[self.fill_value], self.chunk_size)
+        for key, chunk in self.chunks.items():
+            #a chunk of one value maps to one value, asfortranarray would make it a 1d array
+            mapped.chunks[key] = table[chunk] if chunk.ndim == 0 else np.asfortranarray(table[chunk])
+        return mapped
+
+    #diffs, used to store how a level differs from how it was generated
+
+    def changed_chunks(self, base: ChunkedArray) -> Dict[ChunkKey, np.ndarray]:
+        #Return copies of the chunks that arent the same as in base
+        changed = {}
+        for key in self.chunks.keys() | base.chunks.keys():
+            chunk = self.chunk(key)
+            if not np.all(chunk == base.chunk(key)):
+                changed[key] = chunk.copy()
+        return changed
+
+    def update_chunks(self, chunks: Dict[ChunkKey, np.ndarray]) -> None:
+        #Replace chunks with the ones from changed_chunks
+        for key, chunk in chunks.items():
+            if chunk.ndim == 0 and chunk == self.fill_value:
+                self.chunks.pop(key, None)
+            else:
+                self.chunks[key] = chunk.copy()
+
+
+class ChunkedField:
+    #one field of a structured ChunkedArray, array["walkable"][x, y]
+    def __init__(self, array: ChunkedArray, field: str):
+        self.array = array
+        self.field = field
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.array.shape
+
+    def __getitem__(self, index):
+        return self.array.read(index, self.field)
+
+    def __setitem__(self, index, value) -> None:
+        self.array.write(index, value, self.field)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        array = self.array.read((slice(None), slice(None)), self.field)
+        return array if dtype is None else array.astype(dtype)
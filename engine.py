@@ -4,56 +4,87 @@
 
 from __future__ import annotations
 
-from typing import Tuple, Iterable, List, Reversible, TYPE_CHECKING
+from typing import Deque, Tuple, Iterable, List, Optional, Reversible, TYPE_CHECKING
+from collections import deque
 from enum import auto, Enum
-import lzma
-import pickle
-
 import textwrap
+import numpy as np
 from tcod.console import Console
-from tcod.map import compute_fov
 #message log originally imported entire tcod, might need adjust
 import color
 
 import exceptions
+from turn_scheduler import TurnScheduler
+from camera import Camera
 
 
 if TYPE_CHECKING:
     from entity import Actor
+    from movement_batch import MovementBatch
     from world_level import WorldMap, WorldLevel
 
+#part of the screen levels are drawn in, the ui is below it
+VIEWPORT_SIZE = (80, 43)
+
 class Engine:
     world_level: WorldLevel
     world_map: WorldMap
 
     def __init__(self, player: Actor):
         self.message_log = MessageLog()
-        self.mouse_location = (0,0)
+        self.mouse_location = (0,0) #console tile under the mouse, see render_names_at_mouse_location
         self.player = player
+        self.turn = 0
+        self._player_distance_map: Optional[np.ndarray] = None
+        self._player_distance_map_key: Optional[Tuple] = None
+        self.scheduler = TurnScheduler()
+        self.movement_batch: Optional[MovementBatch] = None #only set while npc turns are running
+        self.camera = Camera(*VIEWPORT_SIZE)
     
     #the init requiring the player might become a problem when handling worldlevels without a player?
 
+    def get_player_distance_map(self) -> Tuple[Tuple[slice, slice], np.ndarray]:
+        #Return the box around the player and the distance from every tile in it to the player
+        #shared by every ai this turn, only computed the first time an ai asks for it in a turn
+        key = (id(self.world_level), self.player.x, self.player.y, self.turn)
+        if key != self._player_distance_map_key:
+            self._player_distance_map = self.world_level.compute_distance_map(
+                self.player.x, self.player.y
+            )
+            self._player_distance_map_key = key
+        return self._player_distance_map
+
     def handle_npc_turns(self) -> None:
-        for entity in set(self.world_level.actors) - {self.player}:
-            if entity.ai:
-                try:
-                    entity.ai.perform()
-                except exceptions.Impossible:
-                    pass # ignore impossible actions from ai
-
-    def update_fov(self) -> None:
-        #Recompute the visible area based on the players point of view
-        #might want to adjust to allow for other mechanics to give additional/remote sight?
-        self.world_level.visible[:] = compute_fov(
-            self.world_level.tiles["transparent"],
-            (self.player.x, self.player.y),
-            radius=8,
-        )
-        #if a tile is "visible" it should be added to "explored"
-        self.world_level.explored |= self.world_level.visible
+        #only actors near the player that have enough energy act, see turn_scheduler.py
+        self.turn += 1
+        self.scheduler.run(self)
+
+    def update_fov(self, radius: int = 8) -> None:
+        #Recompute the visible area from the players point of view and any sight sources on the level
+        #sight sources are added through world_level.fov, for remote sight like scrying
+        world_level = self.world_level
+        views = ((self.player.x, self.player.y, radius), *world_level.fov.sight_sources.values())
+        key = (views, world_level.transparency_version)
+        if key == world_level.fov_key:
+            return #nothing that affects visibility changed since last time
+
+        for bounds in world_level.fov_bounds:
+            world_level.mark_dirty(bounds)
+            world_level.visible[bounds] = False
+
+        world_level.fov_bounds = []
+        for x, y, view_radius in views:
+            bounds, window_visible = world_level.fov.compute(x, y, view_radius)
+            world_level.mark_dirty(bounds)
+            world_level.visible[bounds] |= window_visible
+            #if a tile is "visible" it should be added to "explored"
+            world_level.explored[bounds] |= window_visible
+            world_level.fov_bounds.append(bounds)
+        world_level.fov_key = key
 
     def render(self, console: Console) -> None:
-        self.world_level.render(console)
+        self.camera.follow(self.player.x, self.player.y, self.world_level.width, self.world_level.height)
+        self.world_level.render(console, self.camera)
 
         self.message_log.render(console=console, x=21, y=45, width=40, height=5)
 
@@ -74,11 +105,25 @@ class Engine:
             console=console, x=21, y=44, engine=self
         )
 
-    def save_as(self, filename: str) -> None:
-        #Save this Engine instance as a compressed file
-        save_data = lzma.compress(pickle.dumps(self))
-        with open(filename, "wb") as f:
-            f.write(save_data)
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        #the distance map is recomputed when an ai next needs it
+        state["_player_distance_map"] = state["_player_distance_map_key"] = None
+        #the queue is rebuilt from the actors energy the next turn
+        state["scheduler"] = TurnScheduler()
+        return state
+
+    def save_as(self, filename: str, codec: Optional[str] = None, level: Optional[int] = None) -> None:
+        #Save this Engine instance as a chunked save archive, see save_archive.py
+        #codec and level pick the compressor and compression level, defaulting to save_archive's defaults
+        import save_archive
+
+        save_archive.save_engine(
+            self,
+            filename,
+            codec=codec or save_archive.DEFAULT_CODEC,
+            level=save_archive.DEFAULT_LEVEL if level is None else level,
+        )
 
 
 
@@ -96,7 +141,7 @@ def get_names_at_location(x: int, y: int, world_level: WorldLevel) -> str:
         return ""
     
     names = ", ".join(
-        entity.name for entity in world_level.entities if entity.x == x and entity.y == y
+        entity.name for entity in world_level.get_entities_at_location(x, y)
     )
 
     return names.capitalize()
@@ -128,7 +173,12 @@ def render_world_level(
 def render_names_at_mouse_location(
     console: Console, x: int, y: int, engine: Engine
 ) -> None:
-    mouse_x, mouse_y = engine.mouse_location
+    #the mouse is kept as a console tile and turned into a level position here, after the camera has
+    #followed the player, so the names follow the tile under the mouse when the view scrolls
+    location = engine.camera.to_level(*engine.mouse_location)
+    if location is None:
+        return
+    mouse_x, mouse_y = location
 
     names_at_mouse_location = get_names_at_location(
         x=mouse_x, y=mouse_y, world_level=engine.world_level
@@ -143,11 +193,17 @@ class RenderOrder(Enum):
     ACTOR = auto()
 
 #message and messagelog classes
+#number of messages the log keeps, older ones are dropped as new ones come in
+MESSAGE_LOG_SIZE = 500
+
 class Message:
     def __init__(self, text:str, fg:Tuple[int, int, int]):
         self.plain_text = text
         self.fg = fg
         self.count = 1
+        #lines from the last wrap and the (count, width) they were wrapped for
+        self.wrapped_key: Optional[Tuple[int, int]] = None
+        self.wrapped_lines: List[str] = []
 
     @property
     def full_text(self) -> str:
@@ -155,10 +211,26 @@ class Message:
         if self.count > 1:
             return f"{self.plain_text} (x{self.count})"
         return self.plain_text
-    
+
+    def wrap(self, width: int) -> List[str]:
+        #Return full_text wrapped to width, only rewrapped when the width or the stack count changes
+        key = (self.count, width)
+        if key != self.wrapped_key:
+            self.wrapped_lines = list(MessageLog.wrap(self.full_text, width))
+            self.wrapped_key = key
+        return self.wrapped_lines
+
+    def __getstate__(self) -> dict:
+        #the wrapped lines are cheap to redo, so they arent saved
+        state = self.__dict__.copy()
+        state["wrapped_key"] = None
+        state["wrapped_lines"] = []
+        return state
+
 class MessageLog:
     def __init__(self) -> None:
-        self.messages: List[Message] = []
+        #ring buffer, only the newest MESSAGE_LOG_SIZE messages are kept (and saved)
+        self.messages: Deque[Message] = deque(maxlen=MESSAGE_LOG_SIZE)
 
     def add_message(
             self, text: str, fg: Tuple[int, int, int] = color.white, *, stack: bool = True,
@@ -198,11 +270,12 @@ class MessageLog:
     ) -> None:
         #render the messages provided
         #the messages are rendered starting at the last message and working backwards
+        #messages keep their wrapped lines, so this only costs the lines that fit in height
         y_offset = height - 1
 
         for message in reversed(messages):
-            for line in reversed(list(cls.wrap(message.full_text, width))):
+            for line in reversed(message.wrap(width)):
                 console.print(x=x, y=y + y_offset, string=line, fg=message.fg)
                 y_offset -= 1
                 if y_offset < 0:
-                    return # No more space to print messages
\ No newline at end of file
+                    return # No more space to print messages
@@ -1,25 +1,86 @@
 # incorporates entity, entity related components
 from __future__ import annotations
 
-import copy
 import math
-from typing import Optional, Tuple, Type, TypeVar, List, TYPE_CHECKING, Union
+from typing import Dict, Optional, Tuple, Type, TypeVar, List, TYPE_CHECKING, Union
 
 from engine import RenderOrder, MessageLog
 
 if TYPE_CHECKING:
     from world_level import WorldLevel
+    from entity_components.ai import BaseAI
+    from entity_components.component_store import ComponentStore
     #imported components+gamemap in past
 
 T = TypeVar("T", bound="Entity")
 
+#slots that tie an entity to where it is, clones start without them and they arent pickled with the entity
+DETACHED_SLOTS = ("parent", "component_store", "component_id")
+
+def get_clone_slots(cls: type) -> Tuple[str, ...]:
+    #Return the slots of an entity class and its bases that clone copies
+    return tuple(
+        slot
+        for klass in reversed(cls.__mro__)
+        for slot in klass.__dict__.get("__slots__", ())
+        if slot not in DETACHED_SLOTS
+    )
+
+def component_attribute(name: str, column: str, to_column=lambda value: value) -> property:
+    #Return a property for an entity attribute that writes through to a ComponentStore column
+    #reads come from the entity itself, so they cost the same as a plain attribute
+    slot = f"_{name}"
+
+    def get(self: Entity):
+        return getattr(self, slot)
+
+    def set(self: Entity, value) -> None:
+        setattr(self, slot, value)
+        if self.component_store is not None:
+            self.component_store.columns[column][self.component_id] = to_column(value)
+
+    return property(get, set)
+
 #generic entity class with lots of generic variables and methods?
 class Entity:
     #Generic object to represent players, npcs, items, spells, spellbooks
+    #entities use slots instead of a dict, every subclass has to declare the attributes it adds in __slots__
 
     #parent: Union[WorldLevel, Inventory] how are we implementing different kinds of inventories?
     #parent is basically saying where the entity is located, is it currently on the map or in the inventory
     #parent: WorldLevel
+    #while on a WorldLevel the entity is also in the levels ComponentStore under component_id
+    #and the attributes below that have a column are written through to it
+    __slots__ = (
+        "parent", "component_store", "component_id",
+        "_x", "_y", "_char", "_color", "name", "_blocks_movement", "_render_order",
+    )
+
+    x = component_attribute("x", "x")
+    y = component_attribute("y", "y")
+    char = component_attribute("char", "ch", ord)
+    color = component_attribute("color", "fg")
+
+    @property
+    def blocks_movement(self) -> bool:
+        return self._blocks_movement
+
+    @blocks_movement.setter
+    def blocks_movement(self, value: bool) -> None:
+        if self.component_store is not None and value != self._blocks_movement:
+            #while on a level its occupancy grid has to follow along too
+            self.parent.occupancy[self._x, self._y] += 1 if value else -1
+            self.component_store.blocks_movement[self.component_id] = value
+        self._blocks_movement = value
+
+    render_order = component_attribute("render_order", "render_order", lambda order: order.value)
+
+    #every slot clone copies, set for each subclass by __init_subclass__
+    clone_slots: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.clone_slots = get_clone_slots(cls)
 
     def __init__(
         self,
@@ -32,6 +93,8 @@ class Entity:
         blocks_movement: bool = False,
         render_order: RenderOrder = RenderOrder.CORPSE,
     ):
+        self.component_store: Optional[ComponentStore] = None
+        self.component_id = -1
         self.x = x
         self.y = y
         self.char = char
@@ -42,30 +105,64 @@ class Entity:
         if parent:
             #if parent isnt provided now then it will be set later
             self.parent = parent
-            parent.entities.add(self)
+            parent.add_entity(self)
+
+    def __getstate__(self) -> dict:
+        #the component store belongs to the level, the level adds its entities back to a new one after loading
+        state = {slot: getattr(self, slot) for slot in self.clone_slots}
+        if hasattr(self, "parent"):
+            state["parent"] = self.parent
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.component_store = None
+        self.component_id = -1
+
     @property
     def worldlevel(self) -> WorldLevel:
         return self.parent.worldlevel
     
+    def clone(self: T) -> T:
+        #Return a copy of this entity without a parent
+        #attributes are copied shallowly, subclasses copy the ones that need their own instance in copy_fields
+        clone = object.__new__(type(self))
+        for slot in self.clone_slots:
+            setattr(clone, slot, getattr(self, slot))
+        clone.component_store = None
+        clone.component_id = -1
+        clone.copy_fields()
+        return clone
+
+    def copy_fields(self) -> None:
+        #Called on a new clone to replace attributes it shouldnt share with the original
+        pass
+
     def spawn(self: T, worldlevel: WorldLevel, x: int, y: int) -> T:
         #Spawn a copy of this instance at the given location
-        clone = copy.deepcopy(self)
+        clone = self.clone()
         clone.x = x
         clone.y = y
         clone.parent = worldlevel
-        worldlevel.entities.add(clone)
+        worldlevel.add_entity(clone)
         return clone
     
     def place(self, x: int, y: int, worldlevel: Optional[WorldLevel] = None) -> None:
         #Place this entity at a new location. Handles moving across WorldLevels
-        self.x = x
-        self.y = y
         if worldlevel:
             if hasattr(self, "parent"): #Possibly unitialized
                 if self.parent is self.worldlevel:
-                    self.worldlevel.entities.remove(self)
+                    self.worldlevel.remove_entity(self)
+            self.x = x
+            self.y = y
             self.parent = worldlevel
-            worldlevel.entities.add(self)
+            worldlevel.add_entity(self)
+        else:
+            self.x = x
+            self.y = y
+            if hasattr(self, "parent") and self.parent is self.worldlevel:
+                self.worldlevel.update_entity_location(self)
 
     def distance(self, x: int, y: int) -> float:
         #Return distance between the current entity and the given (x, y) coordinates
@@ -75,9 +172,20 @@ class Entity:
         #Move the entity by a given amount
         self.x += dx
         self.y += dy
+        if self.parent is self.worldlevel:
+            self.worldlevel.update_entity_location(self)
+
+Entity.clone_slots = get_clone_slots(Entity)
 
 #actor entity class
 class Actor(Entity):
+    #speed is the energy gained each turn, an action costs turn_scheduler.ACTION_COST (100) energy
+    #energy and energy_turn are kept up to date by the TurnScheduler, see turn_scheduler.py
+    __slots__ = (
+        "ai", "iteminventory", "itemcapacity", "spellbookinventory", "spellbookcapacity",
+        "speed", "energy", "energy_turn", "asleep",
+    )
+
     def __init__(
         self,
         *,
@@ -86,11 +194,13 @@ class Actor(Entity):
         char: str = "?",
         color: Tuple[int, int, int],
         name: str = "<Unnamed>",
-        #ai_cls: Type[BaseAI],
+        ai_cls: Optional[Type[BaseAI]] = None,
         iteminventory: List[Item] = [],
         itemcapacity: int = 0,
         spellbookinventory: List[Spellbook] = [],
         spellbookcapacity: int = 0,
+        speed: int = 100,
+        asleep: bool = False,
         #equipment: Equipment,
         #fighter: Fighter,
         #inventory: Inventory,
@@ -108,7 +218,17 @@ class Actor(Entity):
 
         #instanced component variables, need to be reworked for rework of components
 
-        #self.ai: Optional[BaseAI] = ai_cls(self)
+        self.ai: Optional[BaseAI] = ai_cls(self) if ai_cls else None
+
+        self.iteminventory = list(iteminventory)
+        self.itemcapacity = itemcapacity
+        self.spellbookinventory = list(spellbookinventory)
+        self.spellbookcapacity = spellbookcapacity
+
+        self.speed = speed
+        self.energy = 0
+        self.energy_turn: Optional[int] = None #None until the scheduler first sees this actor
+        self.asleep = asleep #sleeping actors are never scheduled
 
         #self.equipment: Equipment = equipment
         #self.equipment.parent = self
@@ -128,6 +248,15 @@ class Actor(Entity):
         #self.level = level
         #self.level.parent = self
 
+    def copy_fields(self) -> None:
+        #each actor gets its own ai state and its own copies of what it carries
+        if self.ai:
+            self.ai = type(self.ai)(self)
+        self.iteminventory = [item.clone() for item in self.iteminventory]
+        self.spellbookinventory = [spellbook.clone() for spellbook in self.spellbookinventory]
+        self.energy = 0
+        self.energy_turn = None
+
     @property
     def is_alive(self) -> bool:
         #Returns true while this actor can perform actions
@@ -136,6 +265,8 @@ class Actor(Entity):
         
 #item entity class (will the spell and spellbook be separate kinds of entities or special items?)
 class Item(Entity):
+    __slots__ = ()
+
     def __init__(
         self,
         *,
@@ -168,6 +299,8 @@ class Item(Entity):
             #self.equippable.parent = self
 
 class Spell(Entity):
+    __slots__ = ("manacost", "flowcost")
+
     def __init__(
         self,
         *,
@@ -188,8 +321,12 @@ class Spell(Entity):
             blocks_movement=False,
             render_order=RenderOrder.ITEM
         )
+        self.manacost = manacost
+        self.flowcost = flowcost
 
 class Spellbook(Entity):
+    __slots__ = ("manapool", "flowpool", "spellinventory", "spellcapacity")
+
     def __init__(
         self,
         *,
@@ -212,6 +349,14 @@ class Spellbook(Entity):
             blocks_movement=False,
             render_order=RenderOrder.ITEM
         )
+        self.manapool = manapool
+        self.flowpool = flowpool
+        self.spellinventory = list(spellinventory)
+        self.spellcapacity = spellcapacity
+
+    def copy_fields(self) -> None:
+        #the spells are cloned too, the prototype list can hold the same spell prototype more than once
+        self.spellinventory = [spell.clone() for spell in self.spellinventory]
 
     def drop(self, spell: Spell) -> None:
         #only one inventory list and only one type of entity to drop, so only needs which entity as input
@@ -220,6 +365,8 @@ class Spellbook(Entity):
         self.engine.MessageLog.add_message(f"You dropped the {spell.name}.")
 
 class Stair(Entity):
+    __slots__ = ("dest_branch", "dest_branchdepth", "dest_x", "dest_y", "dest_level_name")
+
     def __init__(
         self,
         *,
@@ -313,6 +460,20 @@ stairdown = Stair(
     dest_y=1,
 )
 
+#prototype registry, new entities are made by cloning these instead of deep copying
+prototypes: Dict[str, Entity] = {
+    "player": player,
+    "gnome": gnome,
+    "healthpot": healthpot,
+    "sparkbolt": sparkbolt,
+    "startspellbook1": startspellbook1,
+    "stairdown": stairdown,
+}
+
+def new_entity(name: str) -> Entity:
+    #Return a new entity cloned from the named prototype, without a parent or location
+    return prototypes[name].clone()
+
 
 
 #item related components like equipment/consumable that gives methods to items
@@ -11,43 +11,100 @@ from actions import Action, BumpAction, MeleeAction, MovementAction, WaitAction
 if TYPE_CHECKING:
     from entity import Actor
 
+# How far outside the box between its two ends a path can go.
+PATH_MARGIN = 10
+
 class BaseAI(Action):
+    sight_radius = 8  # How far this AI can see, the same as the player by default.
+
     def perform(self) -> None:
         raise NotImplementedError()
+
+    def can_see_player(self) -> bool:
+        """Return True if this AI's entity can see the player.
+
+        Uses the level's FovService, which answers from the player's own cached
+        FOV when it can, so most checks don't compute a field of view.
+        """
+        player = self.engine.player
+        return self.entity.worldlevel.fov.can_see(
+            self.entity.x, self.entity.y, player.x, player.y, self.sight_radius,
+        )
+
+    def move(self, dx: int, dy: int) -> None:
+        """Move this AI's entity by dx, dy.
+
+        While the scheduler is running NPC turns the move is only submitted to the
+        engine's movement batch, which checks and applies every NPC move at once.
+        """
+        batch = self.engine.movement_batch
+        if batch is None:
+            return MovementAction(self.entity, dx, dy).perform()
+        batch.submit(self.entity, dx, dy)
+
+    def fast_forward(self, actions: int) -> None:
+        """Catch up on actions skipped while the scheduler had this AI parked.
+
+        Called once with the number of actions missed when the actor wakes up,
+        instead of performing each of them.
+        """
     
     def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
         """Compute and return a path to the target position.
 
         If there is no valid path then returns an empty list.
         """
-        # Copy the walkable array.
-        cost = np.array(self.entity.worldlevel.tiles["walkable"], dtype=np.int8)
-
-        for entity in self.entity.worldlevel.entities:
-            # Check that an entity blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
+        level = self.entity.worldlevel
+        x, y = self.entity.x, self.entity.y
+
+        # Only search the box around both ends, so paths cost the same on any size of level.
+        bounds = (
+            slice(max(min(x, dest_x) - PATH_MARGIN, 0), min(max(x, dest_x) + PATH_MARGIN + 1, level.width)),
+            slice(max(min(y, dest_y) - PATH_MARGIN, 0), min(max(y, dest_y) + PATH_MARGIN + 1, level.height)),
+        )
+        left, top = bounds[0].start, bounds[1].start
+
+        # Walkable tiles, with extra cost where blocking entities stand.
+        cost = level.movement_cost(bounds)
 
         # Create a graph from the cost array and pass that graph to a new pathfinder.
         graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
         pathfinder = tcod.path.Pathfinder(graph)
 
-        pathfinder.add_root((self.entity.x, self.entity.y))  # Start position.
+        pathfinder.add_root((x - left, y - top))  # Start position.
 
         # Compute the path to the destination and remove the starting point.
-        path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
+        path: List[List[int]] = pathfinder.path_to((dest_x - left, dest_y - top))[1:].tolist()
+
+        # Convert from List[List[int]] to List[Tuple[int, int]] in level coordinates.
+        return [(index[0] + left, index[1] + top) for index in path]
 
-        # Convert from List[List[int]] to List[Tuple[int, int]].
-        return [(index[0], index[1]) for index in path]
+    def get_step_towards_player(self) -> Optional[Tuple[int, int]]:
+        """Return the next position on the way to the player.
+
+        Reads the engine's shared distance map instead of pathfinding for every
+        AI, returns None if the player can't be reached from here.
+        """
+        bounds, distance = self.engine.get_player_distance_map()
+        # The map only covers the box around the player, move into its coordinates.
+        x, y = self.entity.x - bounds[0].start, self.entity.y - bounds[1].start
+        if not (0 <= x < distance.shape[0] and 0 <= y < distance.shape[1]):
+            return None
+
+        # Look at the 3x3 window around this entity, clipped to the level.
+        left, top = max(x - 1, 0), max(y - 1, 0)
+        window = distance[left : x + 2, top : y + 2]
+        step_x, step_y = np.unravel_index(np.argmin(window), window.shape)
+
+        if window[step_x, step_y] >= distance[x, y]:
+            return None  # No neighbour is closer, unreachable or already there.
+        return bounds[0].start + left + int(step_x), bounds[1].start + top + int(step_y)
     
 class MeleeEnemy(BaseAI):
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path: List[Tuple:[int, int]] = []
+        self.path: List[Tuple[int, int]] = []
+        self.last_seen: Optional[Tuple[int, int]] = None
 
     def perform(self) -> None:
         target = self.engine.player
@@ -55,17 +112,30 @@ class MeleeEnemy(BaseAI):
         dy = target.y - self.entity.y
         distance = max(abs(dx), abs(dy))  # Chebyshev distance.
 
-        if self.engine.world_level.visible[self.entity.x, self.entity.y]:
+        if self.can_see_player():
             if distance <= 1:
                 return MeleeAction(self.entity, dx, dy).perform()
 
-            self.path = self.get_path_to(target.x, target.y)
+            # Chase using the shared distance map while the player is in sight.
+            self.path = []
+            self.last_seen = target.x, target.y
+            step = self.get_step_towards_player()
+            if step:
+                return self.move(step[0] - self.entity.x, step[1] - self.entity.y)
+
+        elif self.last_seen:
+            # Lost sight of the player, path to where they were last seen once.
+            self.path = self.get_path_to(*self.last_seen)
+            self.last_seen = None
 
         if self.path:
             dest_x, dest_y = self.path.pop(0)
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+            return self.move(dest_x - self.entity.x, dest_y - self.entity.y)
 
         return WaitAction(self.entity).perform()
-        #Could implement wandering instead of waiting when noone in sight?
\ No newline at end of file
+        #Could implement wandering instead of waiting when noone in sight?
+
+    def fast_forward(self, actions: int) -> None:
+        # Whatever it was chasing is stale by the time it wakes up.
+        self.path = []
+        self.last_seen = None
\ No newline at end of file
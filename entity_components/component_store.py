@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from entity import Entity
+
+
+class ComponentStore:
+    #struct of arrays storage for the state of every entity on a WorldLevel
+    #each entity on the level gets an id that indexes every column and stays the same while it is on the level
+    #entity attributes that have a column write through to it (see component_attribute in entity.py)
+    #so whole level operations like rendering, occupancy, area effects and ai sweeps can use the columns
+    #ids of removed entities are reused, check active before trusting a row
+
+    #column name: (dtype, shape of one row)
+    COLUMNS = {
+        "x": (np.int32, ()),
+        "y": (np.int32, ()),
+        "blocks_movement": (bool, ()),
+        "ch": (np.int32, ()),#unicode codepoint of char
+        "fg": (np.uint8, (3,)),#rgb of color
+        "render_order": (np.int32, ()),
+        "hp": (np.int32, ()),#not used by any entity yet
+        "mana": (np.int32, ()),#not used by any entity yet
+        "active": (bool, ()),#True for ids that belong to an entity
+    }
+
+    def __init__(self, capacity: int = 64):
+        self.entities: List[Entity] = []#entity for each id, None for free ids
+        self.free_ids: List[int] = []
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.zeros((capacity,) + shape, dtype=dtype)
+            for name, (dtype, shape) in self.COLUMNS.items()
+        }
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        #columns are available as attributes, store.x is store.columns["x"]
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @property
+    def count(self) -> int:
+        #Number of ids handed out so far, every column is only valid up to this
+        return len(self.entities)
+
+    def add(self, entity: Entity) -> int:
+        #Give an entity an id, copy its state into the columns and attach it
+        if self.free_ids:
+            entity_id = self.free_ids.pop()
+            self.entities[entity_id] = entity
+        else:
+            entity_id = len(self.entities)
+            if entity_id == len(self.active):
+                self._grow()
+            self.entities.append(entity)
+
+        self.active[entity_id] = True
+        self.x[entity_id] = entity.x
+        self.y[entity_id] = entity.y
+        self.blocks_movement[entity_id] = entity.blocks_movement
+        self.ch[entity_id] = ord(entity.char)
+        self.fg[entity_id] = entity.color
+        self.render_order[entity_id] = entity.render_order.value
+        self.hp[entity_id] = 0
+        self.mana[entity_id] = 0
+
+        entity.component_store = self
+        entity.component_id = entity_id
+        return entity_id
+
+    def remove(self, entity: Entity) -> None:
+        #Free an entities id and detach the entity from this store
+        entity_id = entity.component_id
+        self.active[entity_id] = False
+        self.x[entity_id] = self.y[entity_id] = 0 #keep free rows inside the level
+        self.entities[entity_id] = None
+        self.free_ids.append(entity_id)
+
+        entity.component_store = None
+        entity.component_id = -1
+
+    def blocking_locations(self) -> Tuple[np.ndarray, np.ndarray]:
+        #Return the x and y of every movement blocking entity
+        blocking = self.active[: self.count] & self.blocks_movement[: self.count]
+        return self.x[: self.count][blocking], self.y[: self.count][blocking]
+
+    def ids_in(self, mask: np.ndarray) -> np.ndarray:
+        #Return the ids of every entity standing on a True tile of mask
+        x, y = self.x[: self.count], self.y[: self.count]
+        return np.flatnonzero(self.active[: self.count] & mask[x, y])
+
+    def ids_in_box(self, bounds: Tuple[slice, slice]) -> np.ndarray:
+        #Return the ids of every entity inside the (x slice, y slice) box
+        xs, ys = self.x[: self.count], self.y[: self.count]
+        inside = (
+            self.active[: self.count]
+            & (xs >= bounds[0].start) & (xs < bounds[0].stop)
+            & (ys >= bounds[1].start) & (ys < bounds[1].stop)
+        )
+        return np.flatnonzero(inside)
+
+    def ids_near(self, x: int, y: int, radius: int) -> np.ndarray:
+        #Return the ids of every entity within radius tiles of x, y (chebyshev distance)
+        xs, ys = self.x[: self.count], self.y[: self.count]
+        near = self.active[: self.count] & (np.abs(xs - x) <= radius) & (np.abs(ys - y) <= radius)
+        return np.flatnonzero(near)
+
+    def _grow(self) -> None:
+        #double the capacity of every column
+        for name, column in self.columns.items():
+            grown = np.zeros((len(column) * 2,) + column.shape[1:], dtype=column.dtype)
+            grown[: len(column)] = column
+            self.columns[name] = grown
@@ -0,0 +1,81 @@
+#event pump for the main loop, decides when to wait for input and when to draw a frame
+#
+#the screen only changes when an event is handled, so frames are only drawn while the pump is dirty
+#and at most frame_rate times a second, between frames it sleeps in tcod.event.wait instead of spinning
+#each batch of events is coalesced before it is handled:
+#   mouse motion, only the last motion of a batch is kept and only if it moved to a new tile
+#   key repeat, only one repeat of each held key is kept so a backlog of repeats doesnt keep the player moving
+#     after the key is let go, fresh key presses are never dropped
+
+from __future__ import annotations
+
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+import tcod
+
+#frames drawn per second at most, None to draw as soon as anything changes
+FRAME_RATE_CAP: Optional[float] = 60.0
+#seconds to wait for input while nothing needs drawing, so the loop still wakes up for autosaves
+IDLE_TIMEOUT = 1.0
+
+
+class EventPump:
+    def __init__(self, frame_rate: Optional[float] = FRAME_RATE_CAP, idle_timeout: float = IDLE_TIMEOUT):
+        self.frame_time = 1 / frame_rate if frame_rate else 0.0
+        self.idle_timeout = idle_timeout
+        self.dirty = True #the first frame always needs drawing
+        self.last_frame = float("-inf")
+        self.mouse_tile: Optional[Tuple[int, int]] = None
+
+    def mark_dirty(self) -> None:
+        #Draw a new frame as soon as the frame rate cap allows
+        self.dirty = True
+
+    def frame_due(self) -> bool:
+        #Return True if something changed and the last frame was long enough ago
+        return self.dirty and time.perf_counter() - self.last_frame >= self.frame_time
+
+    def frame_drawn(self) -> None:
+        self.dirty = False
+        self.last_frame = time.perf_counter()
+
+    def timeout(self) -> Optional[float]:
+        #Return how long to wait for input, until the next frame is due or IDLE_TIMEOUT if nothing is dirty
+        if not self.dirty:
+            return self.idle_timeout
+        return max(0.0, self.frame_time - (time.perf_counter() - self.last_frame))
+
+    def wait(self, context: tcod.context.Context) -> List[tcod.event.Event]:
+        #Wait for input and return it converted to tile coordinates and coalesced
+        events = []
+        for event in tcod.event.wait(self.timeout()):
+            context.convert_event(event)
+            events.append(event)
+        return self.coalesce(events)
+
+    def coalesce(self, events: Iterable[tcod.event.Event]) -> List[tcod.event.Event]:
+        #Return the events worth handling, marking the pump dirty if any are left
+        kept: List[tcod.event.Event] = []
+        last_motion: Optional[tcod.event.MouseMotion] = None
+        repeated_keys: Set[tcod.event.KeySym] = set()
+
+        for event in events:
+            if isinstance(event, tcod.event.MouseMotion):
+                last_motion = event
+                continue
+            if isinstance(event, tcod.event.KeyDown) and event.repeat:
+                if event.sym in repeated_keys:
+                    continue
+                repeated_keys.add(event.sym)
+            kept.append(event)
+
+        if last_motion is not None:
+            tile = (int(last_motion.tile.x), int(last_motion.tile.y))
+            if tile != self.mouse_tile:
+                self.mouse_tile = tile
+                kept.append(last_motion)
+
+        if kept:
+            self.mark_dirty()
+        return kept
@@ -0,0 +1,105 @@
+#field of view for any number of observers on a WorldLevel
+#
+#every level has one FovService (WorldLevel.fov), it computes and caches what can be seen from a point
+#the player, monsters and remote sight sources (scrying, remote eyes) all share the same cache
+#results are keyed by (x, y, radius, transparency_version) so they go stale as soon as tiles change
+#and only the box within radius of the origin is ever computed
+#
+#can_see answers from the observers own fov, the same fov the player sees with. fov uses symmetric
+#shadowcasting where tcod has it, then "A sees B" is the same as "B sees A" when both are transparent,
+#so can_see answers from the targets cached fov if there is one instead of computing the observers,
+#monsters checking for the player use the players view which is always cached
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Tuple, TYPE_CHECKING
+
+import numpy as np
+import tcod.constants
+from tcod.map import compute_fov
+
+if TYPE_CHECKING:
+    from world_level import WorldLevel
+
+#number of recent fov results kept per level, enough for the player, nearby monsters and a few sight sources
+FOV_CACHE_SIZE = 64
+#symmetric shadowcasting needs a newer tcod, older ones fall back to tcods default algorithm
+FOV_ALGORITHM = getattr(tcod.constants, "FOV_SYMMETRIC_SHADOWCAST", tcod.constants.FOV_RESTRICTIVE)
+FOV_SYMMETRIC = FOV_ALGORITHM == getattr(tcod.constants, "FOV_SYMMETRIC_SHADOWCAST", None)
+
+FovKey = Tuple[int, int, int, int]
+FovResult = Tuple[Tuple[slice, slice], np.ndarray] #bounding box and the visible array inside it
+
+
+class FovService:
+    def __init__(self, world_level: WorldLevel):
+        self.world_level = world_level
+        self.cache: OrderedDict[FovKey, FovResult] = OrderedDict()
+        #extra points the player sees from, (x, y, radius) keyed by whatever added them
+        self.sight_sources: Dict[Hashable, Tuple[int, int, int]] = {}
+
+    def __getstate__(self) -> dict:
+        #the cache is rebuilt as needed instead of being saved
+        state = self.__dict__.copy()
+        state["cache"] = OrderedDict()
+        return state
+
+    def compute(self, x: int, y: int, radius: int) -> FovResult:
+        #Return the bounding box around x, y within radius and what is visible inside it
+        world_level = self.world_level
+        key = (x, y, radius, world_level.transparency_version)
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            return result
+
+        bounds = (
+            slice(max(x - radius, 0), x + radius + 1),
+            slice(max(y - radius, 0), y + radius + 1),
+        )
+        window_visible = compute_fov(
+            world_level.transparent[bounds],
+            (x - bounds[0].start, y - bounds[1].start),
+            radius=radius,
+            algorithm=FOV_ALGORITHM,
+        )
+        result = self.cache[key] = bounds, window_visible
+        if len(self.cache) > FOV_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return result
+
+    def visible_from(self, observers: Iterable[Tuple[int, int, int]]) -> np.ndarray:
+        #Return a level sized array of the tiles any of the (x, y, radius) observers can see
+        visible = np.zeros((self.world_level.width, self.world_level.height), dtype=bool, order="F")
+        for x, y, radius in observers:
+            bounds, window_visible = self.compute(x, y, radius)
+            visible[bounds] |= window_visible
+        return visible
+
+    def can_see(self, x: int, y: int, target_x: int, target_y: int, radius: int) -> bool:
+        #Return True if target_x, target_y is in the fov of x, y with radius
+        #the observers fov is only computed if neither it nor, for two transparent tiles, the targets is cached
+        if (target_x - x) ** 2 + (target_y - y) ** 2 > radius ** 2:
+            return False
+        world_level = self.world_level
+        result = self.cache.get((x, y, radius, world_level.transparency_version))
+        if (
+            result is None
+            and FOV_SYMMETRIC
+            and world_level.transparent[target_x, target_y]
+            and world_level.transparent[x, y]
+        ):
+            target_result = self.cache.get((target_x, target_y, radius, world_level.transparency_version))
+            if target_result is not None:
+                bounds, window_visible = target_result
+                return bool(window_visible[x - bounds[0].start, y - bounds[1].start])
+        bounds, window_visible = self.compute(x, y, radius)
+        return bool(window_visible[target_x - bounds[0].start, target_y - bounds[1].start])
+
+    def add_sight_source(self, key: Hashable, x: int, y: int, radius: int) -> None:
+        #Let the player also see everything within radius of x, y until the source is removed
+        self.sight_sources[key] = (x, y, radius)
+
+    def remove_sight_source(self, key: Hashable) -> None:
+        self.sight_sources.pop(key, None)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#headless runner, plays the game without a window or event loop to measure its hot paths
+#actions go through EventHandler.handle_action like keypresses do, and rendering goes to an offscreen Console
+#
+#usage:
+#   python headless.py --turns 1000 --size 80x43 200x120 --monsters 0 50 200 --render
+#   python headless.py --script "llll....jjjj" --turns 500
+#every combination of --size and --monsters is run and reported as one row
+#   python headless.py --turns 500 --monsters 50 --render --profile trace.json
+#--profile also prints the per phase totals and writes every run to one chrome trace
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import random
+import time
+import tracemalloc
+import traceback
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from tcod.console import Console
+
+from actions import Action, BumpAction, WaitAction
+from entity_components.ai import MeleeEnemy
+import entity
+import input_handlers
+import main
+import profiler
+
+try:
+    import resource #not available on windows
+except ImportError:
+    resource = None
+
+if TYPE_CHECKING:
+    from engine import Engine
+    from entity import Actor
+
+#script characters, vi keys to move and . to wait, same as the in game keys
+SCRIPT_KEYS = {
+    "h": (-1, 0),
+    "j": (0, 1),
+    "k": (0, -1),
+    "l": (1, 0),
+    "y": (-1, -1),
+    "u": (1, -1),
+    "b": (-1, 1),
+    "n": (1, 1),
+    ".": None,
+}
+
+#same as the game window, the camera only draws the part of the level that fits
+CONSOLE_SIZE = (80, 50)
+
+
+class BenchmarkResult(NamedTuple):
+    level_width: int
+    level_height: int
+    monsters: int
+    turns: int
+    seconds: float
+    turn_times: List[float]
+    frame_times: List[float]
+    peak_memory: Optional[int] #bytes, None if it couldnt be measured
+    errors: int
+
+    @property
+    def turns_per_second(self) -> float:
+        return self.turns / self.seconds if self.seconds else 0.0
+
+
+def build_engine(level_width: int, level_height: int, monsters: int, rng: random.Random) -> Engine:
+    #Return a new game with monsters placed on random free floor tiles of the starting level
+    engine = main.new_game(level_width, level_height)
+    world_level = engine.world_level
+
+    #random tries instead of listing every free tile, which would be slow on huge levels
+    placed = 0
+    for _ in range(monsters * 20):
+        if placed == monsters:
+            break
+        x, y = rng.randrange(world_level.width), rng.randrange(world_level.height)
+        if world_level.walkable[x, y] and not world_level.get_entities_at_location(x, y):
+            monster = entity.gnome.spawn(world_level, x, y)
+            monster.ai = MeleeEnemy(monster)
+            placed += 1
+
+    return engine
+
+
+def random_actions(player: Actor, rng: random.Random) -> Iterator[Action]:
+    #Yield an endless random walk, waiting now and then
+    directions = [direction for direction in SCRIPT_KEYS.values() if direction]
+    while True:
+        if rng.random() < 0.1:
+            yield WaitAction(player)
+        else:
+            yield BumpAction(player, *rng.choice(directions))
+
+
+def scripted_actions(player: Actor, script: str) -> Iterator[Action]:
+    #Yield the actions spelled out by script, starting over when it runs out
+    for key in itertools.cycle(script):
+        direction = SCRIPT_KEYS[key]
+        yield BumpAction(player, *direction) if direction else WaitAction(player)
+
+
+def run(
+    engine: Engine,
+    actions: Iterator[Action],
+    turns: int,
+    console: Optional[Console] = None,
+) -> Tuple[float, List[float], List[float], int]:
+    #Feed turns actions through the event handler, rendering into console after each if given
+    #returns the total seconds, the time of each action, the time of each render and the number of errors
+    #errors are caught and logged like the main loop does, so a broken ai doesnt end a long run
+    #(monsters next to the player currently raise NotImplementedError from MeleeAction)
+    handler = input_handlers.MainGameEventHandler(engine)
+    turn_times: List[float] = []
+    frame_times: List[float] = []
+    errors = 0
+
+    start = time.perf_counter()
+    for action in itertools.islice(actions, turns):
+        turn_start = time.perf_counter()
+        try:
+            handler.handle_action(action)
+        except Exception:
+            errors += 1
+            engine.message_log.add_message(traceback.format_exc())
+        turn_times.append(time.perf_counter() - turn_start)
+
+        if console is not None:
+            frame_start = time.perf_counter()
+            with profiler.phase("frame"):
+                console.clear()
+                handler.on_render(console)
+            frame_times.append(time.perf_counter() - frame_start)
+
+    return time.perf_counter() - start, turn_times, frame_times, errors
+
+
+def benchmark(
+    level_width: int,
+    level_height: int,
+    monsters: int,
+    turns: int,
+    *,
+    render: bool = False,
+    script: Optional[str] = None,
+    seed: int = 0,
+    trace_memory: bool = False,
+) -> BenchmarkResult:
+    #Build a game of the given size and time turns actions on it
+    #with trace_memory the peak is python allocations from tracemalloc, which slows everything down
+    #otherwise it is the peak resident size of the whole process so far
+    rng = random.Random(seed)
+    if trace_memory:
+        tracemalloc.start()
+
+    engine = build_engine(level_width, level_height, monsters, rng)
+    if script:
+        actions = scripted_actions(engine.player, script)
+    else:
+        actions = random_actions(engine.player, rng)
+
+    console = None
+    if render:
+        console = Console(*CONSOLE_SIZE, order="F")
+
+    seconds, turn_times, frame_times, errors = run(engine, actions, turns, console)
+
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    elif resource:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 #kilobytes on linux
+    else:
+        peak_memory = None
+
+    engine.world_map.shutdown()
+
+    return BenchmarkResult(
+        level_width, level_height, monsters, turns, seconds, turn_times, frame_times, peak_memory, errors,
+    )
+
+
+def milliseconds(times: Sequence[float], percentile: float) -> str:
+    #Return the given percentile of times as milliseconds, or - if nothing was timed
+    if not times:
+        return "-"
+    ordered = sorted(times)
+    return f"{ordered[min(int(len(ordered) * percentile), len(ordered) - 1)] * 1000:.3f}"
+
+
+def print_results(results: Sequence[BenchmarkResult]) -> None:
+    print(
+        f"{'size':>9} {'monsters':>8} {'turns/s':>10} {'turn p50':>9} {'turn p99':>9}"
+        f" {'frame p50':>9} {'frame p99':>9} {'peak MiB':>9} {'errors':>6}"
+    )
+    for result in results:
+        peak = f"{result.peak_memory / 2**20:.1f}" if result.peak_memory is not None else "-"
+        print(
+            f"{result.level_width:>4}x{result.level_height:<4} {result.monsters:>8}"
+            f" {result.turns_per_second:>10.1f}"
+            f" {milliseconds(result.turn_times, 0.5):>9} {milliseconds(result.turn_times, 0.99):>9}"
+            f" {milliseconds(result.frame_times, 0.5):>9} {milliseconds(result.frame_times, 0.99):>9}"
+            f" {peak:>9} {result.errors:>6}"
+        )
+
+
+def print_phases(active: profiler.Profiler) -> None:
+    print(f"\n{'phase':<24} {'calls':>9} {'total ms':>10} {'ms/call':>9}")
+    for name, stats in sorted(active.stats.items(), key=lambda item: item[1].total, reverse=True):
+        print(f"{name:<24} {stats.calls:>9} {stats.total * 1000:>10.1f} {stats.total / stats.calls * 1000:>9.4f}")
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width < 3 or height < 3:
+        raise argparse.ArgumentTypeError("levels must be at least 3x3")
+    return width, height
+
+
+def parse_script(text: str) -> str:
+    unknown = set(text) - set(SCRIPT_KEYS)
+    if unknown or not text:
+        raise argparse.ArgumentTypeError(
+            f"scripts use the keys {''.join(SCRIPT_KEYS)}, got {''.join(sorted(unknown)) or 'nothing'}"
+        )
+    return text
+
+
+def main_headless(argv: Optional[Sequence[str]] = None) -> List[BenchmarkResult]:
+    parser = argparse.ArgumentParser(description="Run Rogue Bibliomancy without a window and time it.")
+    parser.add_argument("--turns", type=int, default=1000, help="player actions per run")
+    parser.add_argument(
+        "--size", type=parse_size, nargs="+", default=[(80, 43)], metavar="WxH", help="level sizes to run"
+    )
+    parser.add_argument("--monsters", type=int, nargs="+", default=[0], help="monster counts to run")
+    parser.add_argument("--render", action="store_true", help="render every turn to an offscreen console")
+    parser.add_argument(
+        "--script", type=parse_script, help="actions to repeat instead of a random walk, vi keys and . to wait"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed for monster placement and the random walk")
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="report peak python allocations instead of peak rss (slow)"
+    )
+    parser.add_argument("--profile", metavar="FILE", help="time each phase and write a chrome trace to FILE")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profiler.enable()
+    results = [
+        benchmark(
+            width,
+            height,
+            monsters,
+            args.turns,
+            render=args.render,
+            script=args.script,
+            seed=args.seed,
+            trace_memory=args.tracemalloc,
+        )
+        for (width, height), monsters in itertools.product(args.size, args.monsters)
+    ]
+    print_results(results)
+    if args.profile:
+        print_phases(profiler.profiler)
+        profiler.disable(args.profile)
+    return results
+
+
+if __name__ == "__main__":
+    main_headless()
@@ -18,6 +18,7 @@ from actions import (Action, WaitAction, BumpAction)
 
 import color
 import exceptions
+import profiler
 
 if TYPE_CHECKING:
     from engine import Engine
@@ -122,11 +123,12 @@ class EventHandler(BaseEventHandler):
         return True
     
     def ev_mousemotion(self, event:tcod.event.MouseMotion) -> None:
-        if self.engine.world_level.in_bounds(event.tile.x, event.tile.y):
-            self.engine.mouse_location = event.tile.x, event.tile.y
+        self.engine.mouse_location = int(event.tile.x), int(event.tile.y)
 
     def on_render(self, console: tcod.Console) -> None:
         self.engine.render(console)
+        if profiler.profiler:
+            profiler.profiler.render_overlay(console)
 
 class MainGameEventHandler(EventHandler):
     def ev_keydown(self, event: tcod.event.KeyDown) -> Optional[ActionOrHandler]:
@@ -147,6 +149,9 @@ class MainGameEventHandler(EventHandler):
 
         elif key == tcod.event.KeySym.ESCAPE:
             raise SystemExit()
+
+        elif key == tcod.event.KeySym.F12:
+            profiler.toggle() #turning it off writes profile_trace.json
         
         
 
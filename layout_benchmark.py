@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#times each level layout generator in layouts.py, and whole Library levels built from them
+#
+#usage:
+#   python layout_benchmark.py --size 80x43 500x500 2000x2000 --runs 20
+#every generator is run --runs times at every size, each run with its own seed
+
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from headless import milliseconds, parse_size
+import layouts
+import main
+import procgen
+
+
+class LayoutResult(NamedTuple):
+    generator: str
+    level_width: int
+    level_height: int
+    times: List[float]
+    floor: float #fraction of the level that ended up floor, to see the generators are doing something
+
+
+def generators(width: int, height: int) -> Dict[str, Callable[[np.random.Generator], np.ndarray]]:
+    #Return each thing to time, as a function of a rng returning the floor it made
+    caves = layouts.cellular_caves(np.random.default_rng(0), width, height)
+    return {
+        "bsp_rooms": lambda rng: layouts.bsp_rooms(rng, width, height),
+        "cellular_caves": lambda rng: layouts.cellular_caves(rng, width, height),
+        "drunkard_walk": lambda rng: layouts.drunkard_walk(
+            rng, width, height, width * height // procgen.TILES_PER_WALKER + 1
+        ),
+        "stacks": lambda rng: layouts.stacks(rng, caves),
+        "label_regions": lambda rng: layouts.label_regions(caves)[0] > 0,
+        "connect_regions": lambda rng: layouts.connect_regions(rng, caves),
+    }
+
+
+def benchmark(name: str, generate: Callable, width: int, height: int, runs: int, seed: int) -> LayoutResult:
+    times, floor = [], 0.0
+    for run in range(runs):
+        rng = np.random.default_rng(seed + run)
+        start = time.perf_counter()
+        result = generate(rng)
+        times.append(time.perf_counter() - start)
+        floor += np.count_nonzero(result) / result.size
+    return LayoutResult(name, width, height, times, floor / runs)
+
+
+def benchmark_levels(branchdepth: int, width: int, height: int, runs: int, seed: int) -> LayoutResult:
+    #Time whole Library levels, layout, tile ids and writing them into the level
+    engine = main.new_game(width, height)
+    library = procgen.Library(branchdepth)
+    times, floor = [], 0.0
+    for run in range(runs):
+        start = time.perf_counter()
+        level = library.generate_level(branchdepth, width, height, engine, seed=seed + run)
+        times.append(time.perf_counter() - start)
+        floor += np.count_nonzero(np.array(level.walkable)) / (width * height)
+    engine.world_map.shutdown()
+    return LayoutResult(f"Library-{branchdepth}", width, height, times, floor / runs)
+
+
+def print_results(results: Sequence[LayoutResult]) -> None:
+    print(f"{'generator':<16} {'size':>9} {'p50 ms':>9} {'p99 ms':>9} {'floor':>6}")
+    for result in results:
+        print(
+            f"{result.generator:<16} {result.level_width:>4}x{result.level_height:<4}"
+            f" {milliseconds(result.times, 0.5):>9} {milliseconds(result.times, 0.99):>9} {result.floor:>6.2f}"
+        )
+
+
+def main_benchmark(argv: Optional[Sequence[str]] = None) -> List[LayoutResult]:
+    parser = argparse.ArgumentParser(description="Time the Rogue Bibliomancy level layout generators.")
+    parser.add_argument(
+        "--size", type=parse_size, nargs="+", default=[(80, 43)], metavar="WxH", help="level sizes to run"
+    )
+    parser.add_argument("--runs", type=int, default=20, help="runs of each generator at each size")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run, later runs count up from it")
+    args = parser.parse_args(argv)
+
+    results = []
+    for width, height in args.size:
+        for name, generate in generators(width, height).items():
+            results.append(benchmark(name, generate, width, height, args.runs, args.seed))
+        #depth 1 is rooms and stacks, depth 3 is caves
+        for branchdepth in (1, 3):
+            results.append(benchmark_levels(branchdepth, width, height, args.runs, args.seed))
+    print_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    main_benchmark()
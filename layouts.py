@@ -0,0 +1,263 @@
+#level layout generators, each returns a level sized bool array of floor tiles (True) and walls (False)
+#
+#everything works on whole arrays at once instead of tile by tile, so a generator costs a handful of numpy
+#passes over the level no matter how many rooms, walkers or cave cells it makes
+#all randomness comes from the np.random.Generator passed in, so the same seed always gives the same layout
+#the outer edge of the level is always left as wall
+#
+#   bsp_rooms           rooms in a binary space partition, every split joined by an L shaped corridor
+#   cellular_caves      cave noise smoothed by a cellular automaton
+#   drunkard_walk       winding corridors from random walkers
+#   stacks              rows of shelves inside the open parts of a layout
+#   label_regions       connected regions of a layout, and connect_regions built on it
+
+from __future__ import annotations
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+#smallest side of a bsp leaf, rooms are at most this big minus the walls around them
+BSP_MIN_SIZE = 8
+#chance each tile starts as wall before the caves are smoothed
+CAVE_FILL = 0.45
+CAVE_STEPS = 4
+#floor tiles dug per drunkard walker
+WALK_LENGTH = 200
+
+#cardinal steps for the random walkers
+DIRECTIONS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)])
+
+
+def fill_rects(
+    width: int, height: int, x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray,
+) -> np.ndarray:
+    #Return a bool array covering every rectangle [x0, x1) x [y0, y1)
+    #each rectangle only touches its 4 corners of a difference array, two cumsums then fill them all in
+    size = (width + 1) * (height + 1)
+    added = np.bincount(np.concatenate([x0 * (height + 1) + y0, x1 * (height + 1) + y1]), minlength=size)
+    removed = np.bincount(np.concatenate([x1 * (height + 1) + y0, x0 * (height + 1) + y1]), minlength=size)
+    corners = (added - removed).astype(np.int32).reshape(width + 1, height + 1)
+    np.add.accumulate(corners, axis=0, out=corners)
+    np.add.accumulate(corners, axis=1, out=corners)
+    return np.asfortranarray(corners[:width, :height] > 0)
+
+
+def tunnel_rects(
+    start: Tuple[np.ndarray, np.ndarray], end: Tuple[np.ndarray, np.ndarray], rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    #Return x0, y0, x1, y1 of the two legs of L shaped tunnels from each start to each end
+    #each tunnel turns at a random one of its two corners
+    (xa, ya), (xb, yb) = (np.asarray(a) for a in start), (np.asarray(b) for b in end)
+    horizontal_first = rng.random(xa.shape) < 0.5
+    corner_x = np.where(horizontal_first, xb, xa)
+    corner_y = np.where(horizontal_first, ya, yb)
+    #horizontal leg along corner_y, vertical leg along corner_x
+    return (
+        np.concatenate([np.minimum(xa, xb), corner_x]),
+        np.concatenate([corner_y, np.minimum(ya, yb)]),
+        np.concatenate([np.maximum(xa, xb) + 1, corner_x + 1]),
+        np.concatenate([corner_y + 1, np.maximum(ya, yb) + 1]),
+    )
+
+
+def neighbour_count(mask: np.ndarray, edge: bool = False) -> np.ndarray:
+    #Return how many of the 8 tiles around each tile are True, tiles past the edge count as edge
+    padded = np.pad(mask, 1, constant_values=edge).astype(np.int8)
+    width, height = mask.shape
+    count = np.zeros(mask.shape, dtype=np.int8)
+    for dx in (0, 1, 2):
+        for dy in (0, 1, 2):
+            if dx != 1 or dy != 1:
+                count += padded[dx : dx + width, dy : dy + height]
+    return count
+
+
+def bsp_rooms(
+    rng: np.random.Generator, width: int, height: int, min_size: int = BSP_MIN_SIZE,
+) -> np.ndarray:
+    #Return rooms in a binary space partition of the level, with corridors joining the two halves of every split
+    #the tree is split one depth at a time, with every box at that depth split at once
+    boxes = np.array([(0, 0, width, height)])
+    depths = [] #(boxes, which of them were split) for every depth
+    while len(boxes):
+        x0, y0, x1, y1 = boxes.T
+        box_width, box_height = x1 - x0, y1 - y0
+        split_x, split_y = box_width >= 2 * min_size, box_height >= 2 * min_size
+        #split across the longer side, or a random one for squares
+        along_x = split_x & (
+            ~split_y | (box_width > box_height) | ((box_width == box_height) & (rng.random(len(boxes)) < 0.5))
+        )
+        split = split_x | split_y
+        depths.append((boxes, split))
+
+        start = np.where(along_x, x0, y0) + min_size
+        stop = np.where(along_x, x1, y1) - min_size
+        cut = start + (rng.random(len(boxes)) * (stop - start + 1)).astype(int)
+        #the first half of the next depth is the left/top children, the second half the right/bottom ones
+        left, right = boxes[split].copy(), boxes[split].copy()
+        left[:, 2] = np.where(along_x[split], cut[split], x1[split])
+        left[:, 3] = np.where(along_x[split], y1[split], cut[split])
+        right[:, 0] = np.where(along_x[split], cut[split], x0[split])
+        right[:, 1] = np.where(along_x[split], y0[split], cut[split])
+        boxes = np.concatenate([left, right])
+
+    room_x0, room_y0, room_x1, room_y1 = [], [], [], []
+    corridor_starts, corridor_ends = [], []
+    below = None #a point in a room of every box at the next depth down
+    for boxes, split in reversed(depths):
+        x0, y0, x1, y1 = boxes.T
+        #rooms in leaves keep a wall on every side and fill at least half of the leaf
+        inner_width, inner_height = np.maximum(x1 - x0 - 2, 1), np.maximum(y1 - y0 - 2, 1)
+        room_width = inner_width - (rng.random(len(boxes)) * (inner_width // 2 + 1)).astype(int)
+        room_height = inner_height - (rng.random(len(boxes)) * (inner_height // 2 + 1)).astype(int)
+        room_width, room_height = np.maximum(room_width, 1), np.maximum(room_height, 1)
+        left = x0 + 1 + (rng.random(len(boxes)) * (inner_width - room_width + 1)).astype(int)
+        top = y0 + 1 + (rng.random(len(boxes)) * (inner_height - room_height + 1)).astype(int)
+
+        leaf = ~split
+        room_x0.append(left[leaf])
+        room_y0.append(top[leaf])
+        room_x1.append((left + room_width)[leaf])
+        room_y1.append((top + room_height)[leaf])
+
+        points = np.stack([left + room_width // 2, top + room_height // 2], axis=1)
+        if below is not None:
+            children = len(below) // 2
+            corridor_starts.append(below[:children])
+            corridor_ends.append(below[children:])
+            points[split] = below[:children] #a split box is represented by its left/top child
+        below = points
+
+    if corridor_starts:
+        starts, ends = np.concatenate(corridor_starts), np.concatenate(corridor_ends)
+        for rects, corridors in zip(
+            (room_x0, room_y0, room_x1, room_y1),
+            tunnel_rects((starts[:, 0], starts[:, 1]), (ends[:, 0], ends[:, 1]), rng),
+        ):
+            rects.append(corridors)
+    #rooms and corridors are filled in together
+    return fill_rects(
+        width,
+        height,
+        np.concatenate(room_x0),
+        np.concatenate(room_y0),
+        np.concatenate(room_x1),
+        np.concatenate(room_y1),
+    )
+
+
+def cellular_caves(
+    rng: np.random.Generator,
+    width: int,
+    height: int,
+    fill: float = CAVE_FILL,
+    steps: int = CAVE_STEPS,
+) -> np.ndarray:
+    #Return caves made by smoothing random noise, a tile ends up wall if 5 or more of the 9 tiles around it are
+    wall = rng.random((width, height)) < fill
+    for _ in range(steps):
+        wall = neighbour_count(wall, edge=True) + wall >= 5
+    floor = np.asfortranarray(~wall)
+    floor[[0, -1], :] = floor[:, [0, -1]] = False
+    return floor
+
+
+def drunkard_walk(
+    rng: np.random.Generator,
+    width: int,
+    height: int,
+    walkers: int,
+    length: int = WALK_LENGTH,
+    starts: Optional[Sequence[Tuple[int, int]]] = None,
+) -> np.ndarray:
+    #Return the tiles dug by random walkers, each taking length random cardinal steps
+    #all walks are one cumsum over random steps, walkers that would leave the level bounce off the edge
+    if starts is None:
+        start_x = rng.integers(1, max(width - 1, 2), walkers)
+        start_y = rng.integers(1, max(height - 1, 2), walkers)
+    else:
+        start_x, start_y = np.asarray(starts).T
+    steps = DIRECTIONS[rng.integers(0, len(DIRECTIONS), (len(start_x), length))]
+    x = reflect(start_x[:, None] + steps[..., 0].cumsum(axis=1), 1, width - 2)
+    y = reflect(start_y[:, None] + steps[..., 1].cumsum(axis=1), 1, height - 2)
+    floor = np.zeros((width, height), dtype=bool, order="F")
+    floor[x, y] = True
+    floor[start_x, start_y] = True
+    return floor
+
+
+def reflect(position: np.ndarray, low: int, high: int) -> np.ndarray:
+    #Fold positions back into [low, high] as if they bounced off both ends
+    span = max(high - low, 0)
+    if not span:
+        return np.full_like(position, low)
+    position = (position - low) % (2 * span)
+    return low + np.where(position > span, 2 * span - position, position)
+
+
+def stacks(rng: np.random.Generator, floor: np.ndarray, spacing: int = 2, gap: int = 6) -> np.ndarray:
+    #Return shelf tiles in rows through the open parts of floor, with aisles between the rows
+    #shelves only go where all 8 neighbours are floor, which leaves an aisle around every room
+    #and keeps corridors and doorways clear, every row is broken every gap tiles so it can be walked around
+    interior = floor & (neighbour_count(floor) == 8)
+    x, y = np.ogrid[0 : floor.shape[0], 0 : floor.shape[1]]
+    across, along = (x, y) if rng.random() < 0.5 else (y, x)
+    shelves = ((across + rng.integers(spacing)) % spacing == 0) & ((along + rng.integers(gap)) % gap != 0)
+    return interior & shelves
+
+
+def label_regions(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    #Return an array numbering the 4 way connected regions of mask from 1, 0 outside mask,
+    #and the leftmost tile of every region as a (regions, 2) array of x, y
+    #tiles are first grouped into runs down each column, then each pass joins every region to the lowest
+    #numbered region beside it and pointer jumps until every run points straight at its regions root
+    #runs are numbered in row major order, so a regions root is its leftmost run
+    run_starts = mask.copy()
+    run_starts[:, 1:] &= ~mask[:, :-1]
+    starts = np.flatnonzero(run_starts)
+    count = len(starts)
+    #index into parent of every tile, count for tiles outside mask
+    cells = np.where(mask, run_starts.cumsum(dtype=np.int32).reshape(mask.shape) - 1, np.int32(count))
+    parent = np.arange(count + 1, dtype=np.int32)
+
+    while True:
+        labels = parent.take(cells)
+        #tiles in a run share a label, so only the rows need comparing
+        lowest = labels.copy()
+        np.minimum(lowest[1:], labels[:-1], out=lowest[1:])
+        np.minimum(lowest[:-1], labels[1:], out=lowest[:-1])
+        joined = mask & (lowest < labels)
+        if not joined.any():
+            break
+        np.minimum.at(parent, labels[joined], lowest[joined])
+        while True:
+            grandparent = parent.take(parent)
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+    roots = np.flatnonzero(parent[:count] == np.arange(count))
+    numbers = np.zeros(count + 1, dtype=np.int32)
+    numbers[roots] = np.arange(1, len(roots) + 1)
+    return numbers[labels], np.stack(np.unravel_index(starts[roots], mask.shape), axis=1)
+
+
+def connect_regions(
+    rng: np.random.Generator, floor: np.ndarray, min_size: int = 1, keep: Sequence[Tuple[int, int]] = (),
+) -> np.ndarray:
+    #Return floor with tunnels dug so every region can be walked to from every other
+    #regions smaller than min_size are filled in instead, apart from the ones holding a keep point
+    #regions are chained in order of their leftmost tile, so tunnels stay short and dont cross the whole level
+    labels, starts = label_regions(floor)
+    small = np.bincount(labels.ravel(), minlength=len(starts) + 1) < min_size
+    small[0] = False
+    for x, y in keep:
+        small[labels[x, y]] = False
+    if small.any():
+        floor = floor & ~small[labels]
+        starts = starts[~small[1:]]
+    if len(starts) < 2:
+        return floor
+    x, y = starts.T
+    return floor | fill_rects(*floor.shape, *tunnel_rects((x[:-1], y[:-1]), (x[1:], y[1:]), rng))
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
+import os
 import traceback
 
 import exceptions
-import copy
-import lzma
-import pickle
 from typing import Optional
 
 import tcod
@@ -14,6 +12,14 @@ from world_level import WorldMap
 import entity
 import input_handlers
 import color
+import save_archive
+from event_pump import EventPump, FRAME_RATE_CAP
+import profiler
+
+#seconds between background autosaves while in game
+AUTOSAVE_INTERVAL = 60.0
+#set this environment variable to start with profiling on, F12 toggles it in game
+PROFILE_ENV_VAR = "ROGUE_PROFILE"
 
 # incorporates main loop, setup_game
 
@@ -28,28 +34,27 @@ import color
 
 #setup_game new game function, returns a new game session engine instance
 
-def new_game() -> Engine:
+def new_game(level_width: int = 80, level_height: int = 43, world_seed: Optional[int] = None) -> Engine:
     # Return a brand new game session as an Engine instance
     # need to modify the engine initialization code
-    
-    level_width=80
-    level_height=43
+    #level size is only changed from the default by headless.py benchmarks
+    #world_seed is random unless given, pregenerate.py uses it to build a known world ahead of time
 
     depth=0
 
-    player = copy.deepcopy(entity.player)
+    player = entity.new_entity("player")
     engine = Engine(player=player)
 
     engine.world_map = WorldMap(
         engine=engine,
         level_width=level_width,
         level_height=level_height,
-
-        world_level_instances=[],
+        world_seed=world_seed,
     )
 
     engine.world_map.generate_level("Entrance", 1) #testing this line
     player.place(1,1,engine.world_level)
+    engine.world_map.pregenerate_stair_destinations(engine.world_level)
 
     engine.update_fov()
 
@@ -57,9 +62,9 @@ def new_game() -> Engine:
 #setup_game load game function
 def load_game(filename: str) -> Engine:
     #Load an Engine instance from a file
-    with open(filename, "rb") as f:
-        engine = pickle.loads(lzma.decompress(f.read()))
-    assert isinstance(engine, Engine)
+    engine = save_archive.load_engine(filename)
+    engine.update_fov() #levels restored from a diff dont keep visible
+    engine.world_map.pregenerate_stair_destinations(engine.world_level)
     return engine
 
 #mainmenu class, defines what to render as well as inputs
@@ -130,7 +135,13 @@ def save_game(handler: input_handlers.BaseEventHandler, filename:str) -> None:
         handler.engine.save_as(filename)
         print("Game saved.")
 
-def main() -> None:
+def autosave_game(handler: input_handlers.BaseEventHandler, autosaver: save_archive.Autosaver) -> None:
+    #Start a background autosave if the current handler has a living player and one is due
+    if isinstance(handler, input_handlers.EventHandler) and handler.engine.player.is_alive:
+        autosaver.maybe_save(handler.engine)
+
+def main(frame_rate: Optional[float] = FRAME_RATE_CAP) -> None:
+    #frame_rate caps how often the screen is redrawn, None for no cap
     screen_width = 80
     screen_height = 50
     tileset = tcod.tileset.load_tilesheet(
@@ -138,6 +149,10 @@ def main() -> None:
     )
 
     handler: input_handlers.BaseEventHandler = MainMenu()
+    autosaver = save_archive.Autosaver("savegame.sav", interval=AUTOSAVE_INTERVAL)
+    pump = EventPump(frame_rate)
+    if os.environ.get(PROFILE_ENV_VAR):
+        profiler.enable()
 
     #Main game loop below
     with tcod.context.new_terminal(
@@ -150,29 +165,48 @@ def main() -> None:
         root_console = tcod.Console(screen_width, screen_height, order="F")
         try:
             while True:
-                root_console.clear()
-                handler.on_render(console=root_console)
-                context.present(root_console)
+                if pump.frame_due(): #only redraw after something changed, at most frame_rate times a second
+                    with profiler.phase("frame"):
+                        root_console.clear()
+                        handler.on_render(console=root_console)
+                    with profiler.phase("present"):
+                        context.present(root_console)
+                    pump.frame_drawn()
 
                 try:
-                    for event in tcod.event.wait():
-                        context.convert_event(event)
-                        handler = handler.handle_events(event)
+                    for event in pump.wait(context):
+                        with profiler.phase("event"):
+                            handler = handler.handle_events(event)
+                    with profiler.phase("autosave"):
+                        autosave_game(handler, autosaver)
                 except Exception: #In game exceptions
                     traceback.print_exc() #print error to stderr
+                    pump.mark_dirty()
                     #Then print error to message log
                     if isinstance(handler, input_handlers.EventHandler):
                         handler.engine.message_log.add_message(
                             traceback.format_exc(), color.white #might not have a "error" color defined and will need to update later
                         )
         except exceptions.QuitWithoutSaving:
+            #GameOverEventHandler already deleted the save, but an autosave still being written
+            #would put it back, so wait for that to finish and then delete the save again
+            autosaver.shutdown()
+            if os.path.exists("savegame.sav"):
+                os.remove("savegame.sav")
             raise
         except SystemExit: #Save and quit
+            profiler.disable(profiler.TRACE_FILENAME if profiler.profiler else None)
+            autosaver.shutdown() #let a running autosave finish before writing over it
             save_game(handler, "savegame.sav")
             raise
         except BaseException: #Save on any other unexpected exception
+            autosaver.shutdown()
             save_game(handler, "savegame.sav")
             raise
+        finally:
+            #levels still queued to be built in the background would otherwise be built before python can exit
+            if isinstance(handler, input_handlers.EventHandler):
+                handler.engine.world_map.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+#batched npc movement, the npc version of MovementAction
+#
+#while the TurnScheduler runs npc turns, ai moves are submitted here instead of being performed one by one
+#resolve() then checks all of them against the level at once and applies the accepted ones together:
+#   a move is rejected if it leaves the level, ends on a tile that isnt walkable or on a tile a blocking entity
+#   is standing on before the batch, and when several moves end on the same tile the first submitted wins
+#rejected moves are dropped silently, the same as an ai MovementAction raising Impossible
+
+from __future__ import annotations
+
+from typing import Dict, List, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from world_level import WorldLevel
+
+
+class MovementBatch:
+    def __init__(self, world_level: WorldLevel):
+        self.world_level = world_level
+        self.actors: List[Actor] = []
+        self.dx: List[int] = []
+        self.dy: List[int] = []
+        self.pending: Dict[Actor, int] = {} #index of each actors move
+
+    def submit(self, actor: Actor, dx: int, dy: int) -> None:
+        #Add a move to the batch, an actor moving twice (speed over ACTION_COST) resolves its first move first
+        if actor in self.pending:
+            self.resolve()
+        self.pending[actor] = len(self.actors)
+        self.actors.append(actor)
+        self.dx.append(dx)
+        self.dy.append(dy)
+
+    def resolve(self) -> None:
+        #Check every submitted move and apply the accepted ones, then empty the batch
+        world_level = self.world_level
+        #actors can leave the level between submitting and resolving
+        moves = [
+            (actor, dx, dy)
+            for actor, dx, dy in zip(self.actors, self.dx, self.dy)
+            if getattr(actor, "parent", None) is world_level
+        ]
+        self.actors.clear()
+        self.dx.clear()
+        self.dy.clear()
+        self.pending.clear()
+        if not moves:
+            return
+
+        components = world_level.components
+        ids = np.array([actor.component_id for actor, _, _ in moves])
+        old_x, old_y = components.x[ids], components.y[ids]
+        new_x = old_x + np.array([dx for _, dx, _ in moves])
+        new_y = old_y + np.array([dy for _, _, dy in moves])
+
+        accepted = (new_x >= 0) & (new_x < world_level.width) & (new_y >= 0) & (new_y < world_level.height)
+        safe_x, safe_y = np.where(accepted, new_x, 0), np.where(accepted, new_y, 0)
+        accepted &= world_level.walkable[safe_x, safe_y]
+        accepted &= world_level.occupancy[safe_x, safe_y] == 0
+
+        #np.unique returns the first index of each destination, which is the first submitted move
+        candidates = np.flatnonzero(accepted)
+        _, first = np.unique(new_x[candidates] * world_level.height + new_y[candidates], return_index=True)
+        accepted = np.sort(candidates[first])
+        if not len(accepted):
+            return
+
+        blocking = components.blocks_movement[ids[accepted]]
+        world_level.occupancy.add_at((old_x[accepted][blocking], old_y[accepted][blocking]), -1)
+        world_level.occupancy.add_at((new_x[accepted][blocking], new_y[accepted][blocking]), 1)
+        components.x[ids[accepted]] = new_x[accepted]
+        components.y[ids[accepted]] = new_y[accepted]
+
+        #the entity objects and the spatial index still need each move one at a time
+        for i in accepted.tolist():
+            actor = moves[i][0]
+            old_location = (actor._x, actor._y)
+            actor._x, actor._y = int(new_x[i]), int(new_y[i]) #the columns are already written
+            world_level.move_in_index(actor, old_location, (actor._x, actor._y))
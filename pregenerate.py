@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#builds a world ahead of time and writes it as a save that main.load_game (and Continue in the menu) can open
+#
+#levels are generated in a pool of worker processes and stored whole instead of as diffs,
+#so visiting them for the first time only loads them from the archive, nothing is generated in game
+#the same --seed always gives the same levels the game would have generated for that world seed
+#
+#usage:
+#   python pregenerate.py --seed 1234 --levels Library:1-20
+#   python pregenerate.py --seed 1234 --levels Entrance:1 Library:1-5 --size 500x500 --workers 8 -o big.sav
+#Entrance 1, where the player starts, is always built
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from engine import Engine
+from headless import parse_size
+from world_level import WorldMap
+import entity
+import main
+import procgen
+import save_archive
+
+LevelKey = Tuple[str, int]
+
+
+def parse_levels(text: str) -> List[LevelKey]:
+    #Parse Branch:depth or Branch:first-last into (branch, branchdepth) keys
+    branch, _, depths = text.partition(":")
+    if branch not in procgen.BRANCHES:
+        raise argparse.ArgumentTypeError(
+            f"unknown branch {branch!r}, expected one of {', '.join(procgen.BRANCHES)}"
+        )
+    try:
+        first, _, last = depths.partition("-")
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected {branch}:DEPTH or {branch}:FIRST-LAST, got {text!r}")
+    if first < 1 or last < first:
+        raise argparse.ArgumentTypeError(f"depths start at 1 and count up, got {text!r}")
+    return [(branch, depth) for depth in range(first, last + 1)]
+
+
+def build_level_chunk(
+    world_seed: int, level_width: int, level_height: int, branch: str, branchdepth: int,
+) -> Tuple[LevelKey, save_archive.Chunk, float]:
+    #Build one level in a worker process and return it pickled as a save chunk, with how long building took
+    #the worker has its own engine, references to it are stored as the engine of whoever loads the chunk
+    engine = Engine(player=entity.new_entity("player"))
+    engine.world_map = WorldMap(
+        engine=engine, level_width=level_width, level_height=level_height, world_seed=world_seed,
+    )
+    start = time.perf_counter()
+    level = engine.world_map.build_level(branch, branchdepth)
+    seconds = time.perf_counter() - start
+    chunk = save_archive.pickle_chunk(level.__getstate__(), engine, level_chunk=True)
+    return (branch, branchdepth), chunk, seconds
+
+
+def pregenerate(
+    filename: str,
+    world_seed: int,
+    keys: Sequence[LevelKey],
+    level_width: int = 80,
+    level_height: int = 43,
+    workers: Optional[int] = None,
+    codec: str = save_archive.DEFAULT_CODEC,
+    level: int = save_archive.DEFAULT_LEVEL,
+) -> Dict[LevelKey, float]:
+    #Write a new game with every level in keys already generated to filename
+    #Return how long each level took to build
+    engine = main.new_game(level_width, level_height, world_seed=world_seed)
+    world_map = engine.world_map
+    #the levels the new game started building in the background are built by the pool instead
+    world_map.shutdown()
+
+    chunks: Dict[str, save_archive.Chunk] = {}
+    for key, world_level in world_map.world_levels.items():
+        chunks[save_archive.level_chunk_name(*key)] = save_archive.pickle_chunk(
+            world_level.__getstate__(), engine, level_chunk=True
+        )
+
+    times: Dict[LevelKey, float] = {}
+    missing = [key for key in dict.fromkeys(keys) if key not in world_map.world_levels]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(build_level_chunk, world_seed, level_width, level_height, *key) for key in missing
+        ]
+        for future in as_completed(futures):
+            key, chunk, seconds = future.result()
+            chunks[save_archive.level_chunk_name(*key)] = chunk
+            times[key] = seconds
+
+    #the engine chunk needs every level in world_levels, as shells, for load_engine to know where to find them
+    for key in missing:
+        save_archive.level_shell(world_map.world_levels, *key)
+    chunks = {save_archive.ENGINE_CHUNK: save_archive.pickle_chunk(engine, engine, level_chunk=False), **chunks}
+    save_archive.write_archive(chunks, filename, codec, level)
+    return times
+
+
+def main_pregenerate(argv: Optional[Sequence[str]] = None) -> Dict[LevelKey, float]:
+    parser = argparse.ArgumentParser(description="Build a Rogue Bibliomancy world ahead of time as a save file.")
+    parser.add_argument("--seed", type=int, required=True, help="world seed, the same seed gives the same world")
+    parser.add_argument(
+        "--levels",
+        type=parse_levels,
+        nargs="+",
+        default=[],
+        metavar="BRANCH:DEPTHS",
+        help="levels to build, like Library:3 or Library:1-10",
+    )
+    parser.add_argument("--size", type=parse_size, default=(80, 43), metavar="WxH", help="level size")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to one per cpu")
+    parser.add_argument("-o", "--output", default="savegame.sav", help="save file to write")
+    parser.add_argument("--codec", choices=sorted(save_archive.CODECS), default=save_archive.DEFAULT_CODEC)
+    parser.add_argument("--level", type=int, default=save_archive.DEFAULT_LEVEL, help="compression level")
+    args = parser.parse_args(argv)
+
+    keys = [key for keys in args.levels for key in keys]
+    start = time.perf_counter()
+    times = pregenerate(
+        args.output, args.seed, keys, *args.size, workers=args.workers, codec=args.codec, level=args.level,
+    )
+    seconds = time.perf_counter() - start
+
+    for (branch, branchdepth), level_seconds in sorted(times.items()):
+        print(f"{branch}-{branchdepth:<6} {level_seconds * 1000:>10.1f} ms")
+    print(
+        f"{len(times)} levels built in {seconds:.2f} s,"
+        f" {os.path.getsize(args.output) / 2**20:.2f} MiB written to {args.output}"
+    )
+    return times
+
+
+if __name__ == "__main__":
+    main_pregenerate()
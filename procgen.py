@@ -3,25 +3,46 @@
 
 from __future__ import annotations
 
-import random
 from typing import Dict, Iterator, List, Tuple, TYPE_CHECKING
 
+import numpy as np
 import tcod
 
 from world_level import WorldLevel
-import tile_types
 import entity
+import layouts
+import tile_types
 
 if TYPE_CHECKING:
     from engine import Engine
     from entity import Entity
 
+#where the stairs into a branch put the player, see the stairs made in Entrance
+ARRIVAL = (1, 1)
+#floor regions smaller than this are filled in instead of being dug out to the rest of the level
+MIN_REGION_SIZE = 12
+#level area per drunkard walker in the Library caves
+TILES_PER_WALKER = 2000
+
+
 #using a similar object structure to event handlers in input_handlers.py
+#generate_level has to be deterministic for a given seed, WorldMap relies on it to regenerate levels
+#so all randomness has to come from np.random.default_rng(seed), never from the global random modules
 class Branch:
     def __init__(self, branchdepth: int):
         self.branchdepth = branchdepth
 
-        #I could move duplicate branch code to here
+    def layout_tiles(
+        self, rng: np.random.Generator, floor: np.ndarray, shelves: np.ndarray, arrival: Tuple[int, int] = ARRIVAL,
+    ) -> np.ndarray:
+        #Return tile ids for a layout from the layouts module, shelves are bookshelf tiles
+        #tiny pockets of floor are filled in, and every other floor tile is made reachable from arrival
+        floor = floor & ~shelves
+        floor[arrival] = True
+        floor = layouts.connect_regions(rng, floor, MIN_REGION_SIZE, keep=[arrival]) #tunnels can dig through shelves
+        tiles = np.where(floor, tile_types.floor, tile_types.wall)
+        tiles[shelves & ~floor] = tile_types.bookshelf
+        return tiles.astype(np.uint8)
 
 
 class Entrance(Branch):
@@ -32,10 +53,11 @@ class Entrance(Branch):
         level_width: int,
         level_height: int,
         engine: Engine,
+        seed: int = 0, #unused, the entrance is always the same
     ) -> WorldLevel:
 
-        player = engine.player
-        level = WorldLevel(engine, level_width, level_height, entities=[player])
+        #the player is placed on the level when it is entered, since levels can be built ahead of time
+        level = WorldLevel(engine, level_width, level_height)
         branch = "Entrance"
 
         level.level_name=f"{branch}-{branchdepth}"
@@ -46,20 +68,18 @@ class Entrance(Branch):
         innerfloor = (slice(1,level_width-1), slice(1,level_height-1))
 
         #level.tiles[outerwall] = tile_types.wall #fill entire level with wall
-        level.tiles[innerfloor] = tile_types.floor #fill entire level with floor except the outer edge?
+        level.set_tiles(innerfloor, tile_types.floor) #fill entire level with floor except the outer edge?
 
         #level.tiles[(42,42)] = tile_types.wall 42 is visible, 43 is a black empty border
         
         #player.place(1,1,level)
-        stairdown = entity.stairdown
+        stairdown = entity.stairdown.spawn(level, 1, 1) #spawn a copy so the prototype is left untouched
         
         stairdown.dest_branch = "Library"
         stairdown.dest_branchdepth = 1
         stairdown.dest_x = 1
         stairdown.dest_y = 1
 
-        stairdown.place(1, 1, level)
-
         return level
     
 class Library(Branch):
@@ -72,25 +92,40 @@ class Library(Branch):
         level_width: int,
         level_height: int,
         engine: Engine,
+        seed: int = 0,
     ) -> WorldLevel:
 
+        rng = np.random.default_rng(seed) #numpy rng, the layouts are made with whole array operations
+
         #I need to double check if I am correctly using instance variables vs class variables
 
-        player = engine.player
-        level = WorldLevel(engine, level_width, level_height, entities=[player])
+        level = WorldLevel(engine, level_width, level_height)
         
         branch = "Library"
 
         level.level_name=f"{branch}-{branchdepth}"
         #use f strings to have it be accurate for subsequent levels in branch
 
-
-        #outerwall = (slice(0,level_width), slice(0,level_height))
-        innerfloor = (slice(1,level_width-1), slice(1,level_height-1))
-
-        #level.tiles[outerwall] = tile_types.wall #fill entire level with wall
-        level.tiles[innerfloor] = tile_types.floor #fill entire level with floor except the outer edge?
+        if branchdepth % 3 == 0:
+            #every third floor is a collapsed wing, caves with winding passages dug through them
+            floor = layouts.cellular_caves(rng, level_width, level_height)
+            walkers = level_width * level_height // TILES_PER_WALKER + 1
+            floor |= layouts.drunkard_walk(rng, level_width, level_height, walkers)
+            shelves = np.zeros_like(floor)
+        else:
+            #reading rooms full of stacks
+            floor = layouts.bsp_rooms(rng, level_width, level_height)
+            shelves = layouts.stacks(rng, floor)
+
+        level.set_tiles((slice(None), slice(None)), self.layout_tiles(rng, floor, shelves))
         
         #player.place(1,1,level)
 
-        return level
\ No newline at end of file
+        return level
+
+
+#branch name -> the Branch that generates its levels, WorldMap.build_level looks branches up here
+BRANCHES: Dict[str, type] = {
+    "Entrance": Entrance,
+    "Library": Library,
+}
@@ -0,0 +1,218 @@
+#hot path instrumentation, records how long each phase of a turn or frame takes and how often it runs
+#
+#nothing here costs anything while profiling is off: enable() swaps the functions listed in TARGETS
+#for timing wrappers and disable() puts the originals back, so the game normally runs the plain functions
+#the main loop uses phase() for the once per frame phases that arent functions of their own
+#
+#while enabled the rolling stats can be drawn over the unused corner of the screen with render_overlay()
+#and every recorded call can be exported as a chrome trace (open it in chrome://tracing or ui.perfetto.dev)
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import importlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, ContextManager, Deque, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+import color
+
+if TYPE_CHECKING:
+    from tcod.console import Console
+
+#functions timed while profiling is enabled, (module, attribute path, phase name)
+#every BaseAI subclass perform is also timed, as "ai <class name>"
+TARGETS = [
+    ("engine", "Engine.handle_npc_turns", "npc turns"),
+    ("engine", "Engine.update_fov", "fov"),
+    ("world_level", "WorldLevel.render", "level render"),
+    ("engine", "MessageLog.render", "message log"),
+    ("save_archive", "snapshot", "save snapshot"),
+    ("save_archive", "write_archive", "save write"),
+    ("save_archive", "load_engine", "load"),
+]
+
+#number of recent calls of each phase the overlay averages over
+ROLLING_WINDOW = 120
+#calls kept for the trace export, the oldest are dropped after this many
+MAX_TRACE_EVENTS = 200_000
+#where the F12 toggle writes the trace when profiling is turned off
+TRACE_FILENAME = "profile_trace.json"
+#the space to the right of the message log below the level, (x, y, width, height)
+OVERLAY_AREA = (61, 43, 19, 7)
+
+
+class PhaseStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.recent: Deque[float] = deque(maxlen=ROLLING_WINDOW)
+
+    @property
+    def recent_average(self) -> float:
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.stats: Dict[str, PhaseStats] = {}
+        #(phase, start, duration, thread id), times in seconds from perf_counter
+        self.events: Deque[Tuple[str, float, float, int]] = deque(maxlen=MAX_TRACE_EVENTS)
+        self.lock = threading.Lock() #autosaves are written from a worker thread
+        self.patched: List[Tuple[object, str, Callable]] = []
+
+    def record(self, name: str, start: float, end: float) -> None:
+        duration = end - start
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = PhaseStats()
+            stats.calls += 1
+            stats.total += duration
+            stats.recent.append(duration)
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def wrap(self, func: Callable, name: str) -> Callable:
+        #Return func wrapped so every call is recorded as the phase name
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+
+        return timed
+
+    def patch(self, owner: object, attribute: str, name: str) -> None:
+        original = owner.__dict__[attribute] if isinstance(owner, type) else getattr(owner, attribute)
+        self.patched.append((owner, attribute, original))
+        setattr(owner, attribute, self.wrap(original, name))
+
+    def install(self) -> None:
+        #Swap every target for its timing wrapper
+        for module_name, path, name in TARGETS:
+            owner = importlib.import_module(module_name)
+            *owners, attribute = path.split(".")
+            for part in owners:
+                owner = getattr(owner, part)
+            self.patch(owner, attribute, name)
+
+        from entity_components.ai import BaseAI
+
+        for ai_cls in all_subclasses(BaseAI):
+            if "perform" in ai_cls.__dict__:
+                self.patch(ai_cls, "perform", f"ai {ai_cls.__name__}")
+
+    def uninstall(self) -> None:
+        #Put back every function install replaced, newest first in case one was patched twice
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched.clear()
+
+    def render_overlay(self, console: Console) -> None:
+        #Draw the phases with the highest recent average, in ms per call and calls so far
+        x, y, width, height = OVERLAY_AREA
+        console.draw_rect(x, y, width, height, ch=ord(" "), bg=color.black)
+        console.print(x, y, f"{'phase':<8}{'ms':>5} {'calls':>5}"[:width], fg=color.white)
+
+        with self.lock:
+            rows = sorted(
+                ((name, stats.recent_average, stats.calls) for name, stats in self.stats.items()),
+                key=lambda row: row[1],
+                reverse=True,
+            )
+        for i, (name, average, calls) in enumerate(rows[: height - 1]):
+            console.print(x, y + 1 + i, f"{name[:8]:<8}{average * 1000:>6.2f}{short_count(calls):>5}"[:width])
+
+    def export_chrome_trace(self, filename: str) -> None:
+        #Write the recorded calls as chrome trace event json, with microsecond timestamps
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace = {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": pid,
+                    "tid": thread_id,
+                }
+                for name, start, duration, thread_id in events
+            ],
+            "displayTimeUnit": "ms",
+        }
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+
+def all_subclasses(cls: type) -> Iterator[type]:
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from all_subclasses(subclass)
+
+
+def short_count(count: int) -> str:
+    if count >= 1_000_000:
+        return f"{count // 1_000_000}M"
+    if count >= 10_000:
+        return f"{count // 1000}k"
+    return str(count)
+
+
+#the active profiler, None while profiling is off
+profiler: Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    #Start profiling with fresh stats, does nothing if already enabled
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+        profiler.install()
+    return profiler
+
+
+def disable(trace_filename: Optional[str] = None) -> None:
+    #Stop profiling, writing the chrome trace to trace_filename first if given
+    global profiler
+    if profiler is None:
+        return
+    profiler.uninstall()
+    if trace_filename:
+        profiler.export_chrome_trace(trace_filename)
+    profiler = None
+
+
+def toggle() -> None:
+    #Turn profiling on, or off and export the trace to TRACE_FILENAME
+    if profiler is None:
+        enable()
+    else:
+        disable(TRACE_FILENAME)
+
+
+def phase(name: str) -> ContextManager:
+    #Return a context manager that records its body as the phase name while profiling is on
+    #while off this is a shared do nothing context, so it is cheap enough for once per frame phases
+    if profiler is None:
+        return NULL_PHASE
+    return timed_phase(profiler, name)
+
+
+@contextlib.contextmanager
+def timed_phase(active: Profiler, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.record(name, start, time.perf_counter())
+
+
+NULL_PHASE = contextlib.nullcontext()
@@ -0,0 +1,416 @@
+#save archive format, the engine and each WorldLevel are stored as separate chunks
+#levels that didnt change since the last save are copied over from the old archive
+#instead of being compressed again, so save time depends on what changed and not on world size
+
+#large numpy arrays in level chunks (tiles, visible, explored) are stored uncompressed next to the chunk
+#so loading reads them straight into the arrays instead of decompressing them,
+#and only the engine and the current level are loaded up front, other levels are loaded when WorldMap needs them
+#WorldMap also uses single level archives to spill levels out of memory, those are memory mapped instead of read
+
+#an archive keeps nothing open between reads, windows cant replace a file that is open or mapped
+#and the save file is replaced by every save. spill files are never replaced, so mapping them is fine
+
+#file layout:
+#   MAGIC
+#   chunk data, one compressed pickle per chunk followed by its uncompressed array buffers
+#   index, json describing where each chunk and buffer is and how it was compressed
+#   trailer, index offset + index length + MAGIC
+
+from __future__ import annotations
+
+import bz2
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import pickle
+import struct
+import time
+import traceback
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from engine import Engine
+from world_level import WorldLevel
+
+MAGIC = b"RBSAVE01"
+TRAILER = struct.Struct("<QQ8s")
+
+#codec name -> (compress(data, level), decompress(data))
+CODECS: Dict[str, Tuple[Callable[[bytes, int], bytes], Callable[[bytes], bytes]]] = {
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, max(level, 1)), bz2.decompress),
+    "none": (lambda data, level: data, lambda data: data),
+}
+DEFAULT_CODEC = "lzma"
+DEFAULT_LEVEL = 6
+#levels spilled out of memory by WorldMap favour speed over size
+SPILL_CODEC = "zlib"
+SPILL_LEVEL = 1
+
+ENGINE_CHUNK = "engine"
+#arrays smaller than this many bytes stay inside the compressed pickle instead of being stored uncompressed
+MMAP_THRESHOLD = 4096
+#buffer offsets are aligned to this many bytes
+BUFFER_ALIGNMENT = 64
+
+
+def level_chunk_name(branch: str, branchdepth: int) -> str:
+    return f"level:{branch}:{branchdepth}"
+
+
+class ChunkPickler(pickle.Pickler):
+    #Pickles one chunk, references to objects stored in other chunks are written as persistent ids
+    def __init__(self, file: io.BytesIO, engine: Engine, level_chunk: bool, buffer_callback=None):
+        super().__init__(file, protocol=5, buffer_callback=buffer_callback)
+        self.engine = engine
+        self.level_chunk = level_chunk
+
+    def persistent_id(self, obj: Any) -> Optional[Tuple]:
+        if isinstance(obj, WorldLevel):
+            return ("level", obj.branch, obj.branchdepth)
+        if self.level_chunk:
+            #the engine and player live in the engine chunk
+            if obj is self.engine:
+                return ("engine",)
+            if obj is self.engine.player:
+                return ("player",)
+        return None
+
+
+class ChunkUnpickler(pickle.Unpickler):
+    #levels are resolved through the levels dict, a level that isnt in it yet gets an empty shell
+    def __init__(
+        self,
+        file: io.BytesIO,
+        buffers: List[Union[bytearray, memoryview]],
+        engine: Optional[Engine],
+        levels: Dict[Tuple[str, int], WorldLevel],
+    ):
+        super().__init__(file, buffers=buffers)
+        self.engine = engine
+        self.levels = levels
+
+    def persistent_load(self, pid: Tuple) -> Any:
+        if pid[0] == "level":
+            return level_shell(self.levels, pid[1], pid[2])
+        if pid[0] == "engine":
+            return self.engine
+        if pid[0] == "player":
+            return self.engine.player
+        raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}")
+
+
+def level_shell(levels: Dict[Tuple[str, int], WorldLevel], branch: str, branchdepth: int) -> WorldLevel:
+    #Return the level for branch and branchdepth, creating an empty shell for it if needed
+    key = (branch, branchdepth)
+    if key not in levels:
+        shell = WorldLevel.__new__(WorldLevel)
+        #enough for WorldMap to find the level before it is loaded
+        shell.branch = branch
+        shell.branchdepth = branchdepth
+        levels[key] = shell
+    return levels[key]
+
+
+class Chunk:
+    #An uncompressed chunk, the pickle data plus the array buffers it was pickled with
+    def __init__(self, data: bytes, buffers: List[bytes]):
+        self.data = data
+        self.buffers = buffers
+
+    def digest(self) -> str:
+        sha1 = hashlib.sha1(self.data)
+        for buffer in self.buffers:
+            sha1.update(buffer)
+        return sha1.hexdigest()
+
+
+class StoredChunk:
+    #A chunk that is still only in an archive, it gets copied over without being loaded
+    def __init__(self, archive: SaveArchive, name: str):
+        self.archive = archive
+        self.name = name
+
+
+def pickle_chunk(obj: Any, engine: Engine, level_chunk: bool) -> Chunk:
+    buffers: List[bytes] = []
+
+    def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+        #returning True keeps a buffer in band
+        raw = buffer.raw()
+        if raw.nbytes < MMAP_THRESHOLD:
+            return True
+        buffers.append(bytes(raw)) #copied, so a background save cant see later changes to the array
+        return False
+
+    data = io.BytesIO()
+    ChunkPickler(
+        data, engine, level_chunk, buffer_callback=buffer_callback if level_chunk else None
+    ).dump(obj)
+    return Chunk(data.getvalue(), buffers)
+
+
+def snapshot(engine: Engine) -> Dict[str, Union[Chunk, StoredChunk]]:
+    #Pickle the engine and every level into separate uncompressed chunks
+    #this is the part of saving that has to see a consistent game state
+    chunks: Dict[str, Union[Chunk, StoredChunk]] = {
+        ENGINE_CHUNK: pickle_chunk(engine, engine, level_chunk=False)
+    }
+    world_map = engine.world_map
+    for key, level in world_map.world_levels.items():
+        name = level_chunk_name(*key)
+        if key in world_map.level_sources:
+            #not in memory, so it cant have changed since it was written
+            chunks[name] = StoredChunk(*world_map.level_sources[key])
+        elif key in world_map.level_diffs:
+            chunks[name] = pickle_chunk(world_map.level_diffs[key], engine, level_chunk=True)
+        elif world_map.store_level_diffs:
+            chunks[name] = pickle_chunk(world_map.diff_level(level), engine, level_chunk=True)
+        else:
+            #the level state is pickled instead of the level, so the level itself becomes a persistent id
+            #and loading can fill in the same object everything else refers to
+            chunks[name] = pickle_chunk(level.__getstate__(), engine, level_chunk=True)
+    return chunks
+
+
+class SaveArchive:
+    #Read access to an archive file
+    #chunks are read by offset, opening the file for each read. if the file was replaced since the index was read,
+    #by a save over it, the new index is read first, a save keeps every chunk name of the archive it replaces
+    def __init__(self, filename: str, map_buffers: bool = False):
+        self.filename = filename
+        #if True array buffers are memory mapped copy on write instead of read, only for files that are never replaced
+        self.map_buffers = map_buffers
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.identity: Optional[Tuple[int, int, int]] = None
+        self.open().close()
+
+    def open(self) -> BinaryIO:
+        #Open the file, reading its index first if it isnt the file the index came from
+        f = open(self.filename, "rb")
+        try:
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if identity != self.identity:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f"{self.filename} is not a save archive.")
+                f.seek(-TRAILER.size, os.SEEK_END)
+                index_offset, index_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+                if magic != MAGIC:
+                    raise ValueError(f"{self.filename} is truncated.")
+                f.seek(index_offset)
+                self.index = json.loads(f.read(index_length))
+                self.identity = identity
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def read_raw(self, name: str) -> Tuple[Dict[str, Any], bytes, List[Union[bytearray, memoryview]]]:
+        #Return the index entry, the compressed bytes and the array buffers of a chunk, all from the same file
+        with self.open() as f:
+            entry = self.index[name]
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+            if self.map_buffers and entry["buffers"]:
+                #the mapping stays open as long as the arrays loaded from it
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+                return entry, data, [view[offset : offset + length] for offset, length in entry["buffers"]]
+            buffers = []
+            for offset, length in entry["buffers"]:
+                buffer = bytearray(length) #writable, so loaded arrays can be changed
+                f.seek(offset)
+                f.readinto(buffer)
+                buffers.append(buffer)
+            return entry, data, buffers
+
+    def read_chunk(self, name: str) -> Tuple[bytes, List[Union[bytearray, memoryview]]]:
+        #Return the uncompressed bytes and the array buffers of a chunk
+        entry, data, buffers = self.read_raw(name)
+        return CODECS[entry["codec"]][1](data), buffers
+
+    def level_names(self) -> List[str]:
+        return [name for name in self.index if name != ENGINE_CHUNK]
+
+
+def open_previous(filename: str) -> Optional[SaveArchive]:
+    #Return the archive currently at filename, or None if there isnt a readable one
+    try:
+        return SaveArchive(filename)
+    except (OSError, ValueError, struct.error, json.JSONDecodeError):
+        return None
+
+
+def write_archive(
+    chunks: Dict[str, Union[Chunk, StoredChunk]],
+    filename: str,
+    codec: str = DEFAULT_CODEC,
+    level: int = DEFAULT_LEVEL,
+) -> None:
+    #Compress and write chunks to filename
+    #chunks identical to the ones already in the archive at filename are copied over without recompressing
+    compress = CODECS[codec][0]
+    previous = open_previous(filename)
+    temp_filename = f"{filename}.tmp"
+    index: Dict[str, Dict[str, Any]] = {}
+
+    with open(temp_filename, "wb") as f:
+        f.write(MAGIC)
+        for name, chunk in chunks.items():
+            if isinstance(chunk, StoredChunk):
+                source, source_name = chunk.archive, chunk.name
+            else:
+                source, source_name = previous, name
+                digest = chunk.digest()
+                old_entry = previous.index.get(name) if previous else None
+                if not old_entry or old_entry["digest"] != digest:
+                    source = None
+
+            if source:
+                #unchanged, reuse the compressed data and buffers as is
+                source_entry, compressed, buffers = source.read_raw(source_name)
+                chunk_codec = source_entry["codec"]
+                digest = source_entry["digest"]
+            else:
+                compressed = compress(chunk.data, level)
+                chunk_codec = codec
+                buffers = chunk.buffers
+
+            entry = index[name] = {
+                "offset": f.tell(),
+                "length": len(compressed),
+                "codec": chunk_codec,
+                "digest": digest,
+                "buffers": [],
+            }
+            f.write(compressed)
+            for buffer in buffers:
+                f.write(bytes(-f.tell() % BUFFER_ALIGNMENT))
+                entry["buffers"].append((f.tell(), len(buffer)))
+                f.write(buffer)
+
+        index_data = json.dumps(index).encode("utf-8")
+        index_offset = f.tell()
+        f.write(index_data)
+        f.write(TRAILER.pack(index_offset, len(index_data), MAGIC))
+
+    #replace the old save in one step so a crash mid save cant leave a broken file behind
+    #archives reading from the old file read the index of the new one on their next read
+    os.replace(temp_filename, filename)
+
+
+def save_engine(
+    engine: Engine,
+    filename: str,
+    codec: str = DEFAULT_CODEC,
+    level: int = DEFAULT_LEVEL,
+) -> None:
+    write_archive(snapshot(engine), filename, codec, level)
+
+
+def spill_level(
+    world_level: WorldLevel,
+    engine: Engine,
+    filename: str,
+    codec: str = SPILL_CODEC,
+    level: int = SPILL_LEVEL,
+) -> SaveArchive:
+    #Write a single level to its own archive and return the archive to load it back from
+    name = level_chunk_name(world_level.branch, world_level.branchdepth)
+    write_archive(
+        {name: pickle_chunk(world_level.__getstate__(), engine, level_chunk=True)},
+        filename,
+        codec,
+        level,
+    )
+    return SaveArchive(filename, map_buffers=True)
+
+
+class Autosaver:
+    #Saves periodically without stalling the game
+    #the snapshot is pickled on the calling thread so it sees a consistent game state,
+    #compression, writing and the rename onto the save file happen on a worker thread
+    def __init__(
+        self,
+        filename: str,
+        interval: float = 60.0,
+        codec: str = DEFAULT_CODEC,
+        level: int = DEFAULT_LEVEL,
+    ):
+        self.filename = filename
+        self.interval = interval #seconds between autosaves
+        self.codec = codec
+        self.level = level
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autosave")
+        self.pending: Optional[Future] = None
+        self.last_save = time.monotonic()
+
+    def maybe_save(self, engine: Engine) -> None:
+        #Start a background save if the interval has passed and the last one has finished
+        if self.pending and not self.pending.done():
+            return
+        self.check_pending()
+        if time.monotonic() - self.last_save >= self.interval:
+            self.save(engine)
+
+    def save(self, engine: Engine) -> Future:
+        chunks = snapshot(engine)
+        self.last_save = time.monotonic()
+        self.pending = self.executor.submit(
+            write_archive, chunks, self.filename, self.codec, self.level
+        )
+        return self.pending
+
+    def check_pending(self) -> None:
+        #Report a failed background save, the game keeps going either way
+        if self.pending and self.pending.done():
+            exc = self.pending.exception()
+            self.pending = None
+            if exc:
+                traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+    def wait(self) -> None:
+        #Block until the background save in progress, if any, is written
+        if self.pending:
+            self.pending.exception()
+            self.check_pending()
+
+    def shutdown(self) -> None:
+        self.wait()
+        self.executor.shutdown()
+
+
+def load_level(
+    archive: SaveArchive,
+    name: str,
+    world_level: WorldLevel,
+    engine: Engine,
+    levels: Dict[Tuple[str, int], WorldLevel],
+) -> None:
+    #Fill in a level shell from its chunk, the chunk can be a whole level or a diff to regenerate it from
+    data, buffers = archive.read_chunk(name)
+    state = ChunkUnpickler(io.BytesIO(data), buffers, engine, levels).load()
+    if state.get("level_diff"):
+        engine.world_map.restore_level(world_level, state)
+    else:
+        world_level.__setstate__(state)
+
+
+def load_engine(filename: str) -> Engine:
+    #Load the engine and the current level, every other level is left for WorldMap to load when visited
+    archive = SaveArchive(filename)
+    levels: Dict[Tuple[str, int], WorldLevel] = {}
+    data, buffers = archive.read_chunk(ENGINE_CHUNK)
+    engine = ChunkUnpickler(io.BytesIO(data), buffers, None, levels).load()
+    assert isinstance(engine, Engine)
+
+    world_map = engine.world_map
+    for key in world_map.world_levels:
+        world_map.level_sources[key] = archive, level_chunk_name(*key)
+    world_map.make_resident(engine.world_level)
+    return engine
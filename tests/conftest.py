@@ -0,0 +1,38 @@
+#the game modules are flat top level modules, so the tests import them from the repo root
+import os
+import sys
+from typing import Callable, Iterator, List
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from engine import Engine
+
+
+@pytest.fixture
+def games() -> Iterator[List[Engine]]:
+    #every game a test made, their background level builds are shut down after the test even if it failed
+    engines: List[Engine] = []
+    yield engines
+    for engine in engines:
+        engine.world_map.shutdown()
+
+
+@pytest.fixture
+def new_game(games: List[Engine]) -> Callable[..., Engine]:
+    #main.new_game for tests
+    def make(*args, **kwargs) -> Engine:
+        games.append(main.new_game(*args, **kwargs))
+        return games[-1]
+    return make
+
+
+@pytest.fixture
+def load_game(games: List[Engine]) -> Callable[[str], Engine]:
+    #main.load_game for tests
+    def load(filename: str) -> Engine:
+        games.append(main.load_game(filename))
+        return games[-1]
+    return load
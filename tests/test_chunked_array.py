@@ -0,0 +1,97 @@
+#ChunkedArray against a plain numpy array doing the same things
+
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from chunked_array import ChunkedArray
+import tile_types
+
+
+@pytest.mark.parametrize("width, height, chunk_size", [(70, 45, 16), (130, 64, 64), (5, 5, 4), (70, 45, None)])
+def test_matches_numpy(width, height, chunk_size):
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    reference = np.zeros((width, height), dtype=np.uint8)
+    array = ChunkedArray((width, height), np.uint8, 0, chunk_size)
+    for _ in range(300):
+        x0, x1 = sorted(rng.randrange(width + 1) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height + 1) for _ in range(2))
+        value = rng.randrange(3)
+        operation = rng.randrange(5)
+        if operation == 0:
+            reference[x0:x1, y0:y1] = value
+            array[x0:x1, y0:y1] = value
+        elif operation == 1:
+            block = np_rng.integers(0, 3, (x1 - x0, y1 - y0), dtype=np.uint8)
+            reference[x0:x1, y0:y1] = block
+            array[x0:x1, y0:y1] = block
+        elif operation == 2:
+            mask = np_rng.random((width, height)) < 0.05
+            reference[mask] = value
+            array[mask] = value
+        elif operation == 3:
+            x = rng.randrange(width)
+            reference[x, y0:y1] = value
+            array[x, y0:y1] = value
+        else:
+            x, y = rng.randrange(width), rng.randrange(height)
+            reference[x, y] = value
+            array[x, y] = value
+
+        assert (np.array(array) == reference).all()
+        assert (array[x0:x1, y0:y1] == reference[x0:x1, y0:y1]).all()
+        xs = np_rng.integers(0, width, 20)
+        ys = np_rng.integers(0, height, 20)
+        assert (array[xs, ys] == reference[xs, ys]).all()
+        assert array[int(xs[0]), int(ys[0])] == reference[xs[0], ys[0]]
+
+
+def test_add_at_and_diffs():
+    rng = np.random.default_rng(1)
+    array = ChunkedArray((70, 45), np.int32, 0, 16)
+    reference = np.zeros((70, 45), dtype=np.int32)
+    xs, ys = rng.integers(0, 70, 200), rng.integers(0, 45, 200)
+    array.add_at((xs, ys), 1)
+    np.add.at(reference, (xs, ys), 1)
+    assert (np.array(array) == reference).all()
+
+    base = ChunkedArray((70, 45), np.int32, 0, 16)
+    base.update_chunks(array.changed_chunks(base))
+    assert (np.array(base) == reference).all()
+
+
+def test_map_keeps_uniform_chunks_uniform():
+    #a chunk of one value that isnt the fill value has to stay readable after mapping
+    tiles = ChunkedArray((100, 100), np.uint8, tile_types.wall, 32)
+    tiles[0:64, 0:64] = tile_types.floor #whole chunks, stored as one value
+    tiles[70, 70] = tile_types.floor #one dense chunk
+    walkable = tiles.map(tile_types.tile_table["walkable"])
+    assert walkable.chunks[(0, 0)].ndim == 0
+    assert walkable[24, 24]
+    assert walkable[70, 70] and not walkable[80, 80]
+    assert (walkable[10:40, 10:40]).all()
+    expected = tile_types.tile_table["walkable"][np.array(tiles)]
+    assert (np.array(walkable) == expected).all()
+
+
+@pytest.mark.parametrize("shape", [(70, 45), (300, 200)])
+def test_pickle_round_trip(shape):
+    array = ChunkedArray(shape, np.uint8, 0)
+    array[0:64, 0:32] = 1 #uniform chunks
+    array[5, 40] = 2
+    array[shape[0] - 1, shape[1] - 1] = 3
+    loaded = pickle.loads(pickle.dumps(array, protocol=5))
+    assert (np.array(loaded) == np.array(array)).all()
+    loaded[6, 40] = 4 #chunks loaded from the packed array are still writable
+    assert loaded[6, 40] == 4 and array[6, 40] == 0
+
+
+@pytest.mark.parametrize("shape", [(80, 43), (128, 4)])
+def test_single_chunk_is_no_bigger_than_numpy(shape):
+    array = ChunkedArray(shape, np.uint8, 0)
+    array[1, 2] = 3
+    assert array.allocated_bytes == np.zeros(shape, np.uint8).nbytes
+    assert pickle.loads(pickle.dumps(array)).allocated_bytes == array.allocated_bytes
@@ -0,0 +1,19 @@
+import tcod
+
+import engine as engine_module
+
+
+def test_names_follow_the_mouse_tile_when_the_camera_scrolls(monkeypatch, new_game):
+    engine = new_game(200, 200)
+    looked_at = []
+    monkeypatch.setattr(
+        engine_module, "get_names_at_location", lambda x, y, world_level: looked_at.append((x, y)) or ""
+    )
+    console = tcod.console.Console(80, 50, order="F")
+    engine.player.place(100, 100)
+    engine.mouse_location = (10, 5)
+    engine.render(console)
+    engine.player.place(110, 104) #scrolls the camera without moving the mouse
+    engine.render(console)
+    #the 80x43 viewport is centered on the player, so its top left is 40, 21 up and left of them
+    assert looked_at == [(100 - 40 + 10, 100 - 21 + 5), (110 - 40 + 10, 104 - 21 + 5)]
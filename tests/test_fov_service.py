@@ -0,0 +1,35 @@
+import random
+
+import numpy as np
+from tcod.map import compute_fov
+
+import fov_service
+import tile_types
+
+
+def test_can_see_doesnt_depend_on_what_is_cached(new_game):
+    engine = new_game()
+    world_level = engine.world_level
+    walls = np.random.default_rng(1).random((world_level.width, world_level.height)) < 0.3
+    world_level.set_tiles(walls, tile_types.wall)
+    transparent = np.array(world_level.transparent)
+    rng = random.Random(1)
+    symmetric = 0
+    for _ in range(500):
+        x, y = rng.randrange(world_level.width), rng.randrange(world_level.height)
+        target_x, target_y = x + rng.randint(-8, 8), y + rng.randint(-8, 8)
+        if not world_level.in_bounds(target_x, target_y):
+            continue
+        expected = (target_x - x) ** 2 + (target_y - y) ** 2 <= 64 and compute_fov(
+            transparent, (x, y), radius=8, algorithm=fov_service.FOV_ALGORITHM
+        )[target_x, target_y]
+
+        fov = fov_service.FovService(world_level)
+        assert fov.can_see(x, y, target_x, target_y, 8) == expected #nothing cached
+        fov = fov_service.FovService(world_level)
+        fov.compute(target_x, target_y, 8)
+        assert fov.can_see(x, y, target_x, target_y, 8) == expected #only the targets view cached
+        if fov_service.FOV_SYMMETRIC and transparent[x, y] and transparent[target_x, target_y]:
+            assert len(fov.cache) == 1 #answered from the targets view without computing the observers
+            symmetric += 1
+    assert symmetric or not fov_service.FOV_SYMMETRIC
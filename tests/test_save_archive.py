@@ -0,0 +1,37 @@
+#saving over the file a game was loaded from, which windows only allows if nothing has it open or mapped
+
+import mmap
+
+import numpy as np
+
+import tile_types
+
+
+def is_mapped(array: np.ndarray) -> bool:
+    base = array
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return True
+        base = base.obj if isinstance(base, memoryview) else getattr(base, "base", None)
+    return False
+
+
+def test_levels_load_after_their_save_is_replaced(tmp_path, new_game, load_game):
+    engine = new_game(200, 200)
+    world_map = engine.world_map
+    world_map.store_level_diffs = False #whole levels, so their tiles are stored as buffers
+    other = world_map.build_level("Library", 1)
+    other.set_tiles((slice(3, 9), 3), tile_types.wall)
+    world_map.add_world_level(other)
+    filename = str(tmp_path / "savegame.sav")
+    engine.save_as(filename)
+
+    loaded = load_game(filename)
+    assert ("Library", 1) in loaded.world_map.level_sources
+    assert not is_mapped(loaded.world_level.tiles.chunks[0, 0])
+    loaded.world_level.set_tiles((5, 5), tile_types.wall)
+    loaded.save_as(filename) #replaces the file the Library level is still stored in
+
+    level = loaded.world_map.get_world_level("Library", 1)
+    assert (np.array(level.tiles) == np.array(other.tiles)).all()
+    assert load_game(filename).world_level.tiles[5, 5] == tile_types.wall
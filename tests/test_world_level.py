@@ -0,0 +1,70 @@
+#levels bigger than a few chunks, which the default 80x43 game never makes
+
+import numpy as np
+import pytest
+
+import tile_types
+
+
+def test_fov_on_large_level(new_game):
+    engine = new_game(200, 200)
+    world_level = engine.world_level
+    for step in range(1, 60):
+        engine.player.place(step, step)
+        engine.update_fov()
+        assert world_level.visible[step, step]
+    walkable = tile_types.tile_table["walkable"][np.array(world_level.tiles)]
+    assert (np.array(world_level.walkable) == walkable).all()
+
+
+def test_restored_level_fov_follows_its_own_tiles(new_game):
+    engine = new_game()
+    world_map = engine.world_map
+    world_level = engine.world_level
+    world_level.set_tiles((slice(1, 20), 5), tile_types.wall)
+    world_level.fov.add_sight_source("scrying", 10, 10, 4)
+    diff = world_map.diff_level(world_level)
+
+    world_map.restore_level(world_level, diff)
+    assert world_level.fov.world_level is world_level
+    assert world_level.fov.sight_sources == {"scrying": (10, 10, 4)}
+    assert not world_level.fov.compute(10, 2, 8)[1][10 - 2, 8]
+
+    world_level.set_tiles((10, 5), tile_types.floor) #reopen the wall
+    bounds, visible = world_level.fov.compute(10, 2, 8)
+    assert visible[10 - bounds[0].start, 8 - bounds[1].start]
+
+
+def test_diff_level_doesnt_generate_the_level(monkeypatch, new_game):
+    engine = new_game()
+    world_map = engine.world_map
+    world_level = engine.world_level
+    world_level.set_tiles((slice(1, 20), 5), tile_types.wall)
+    world_level.set_tiles((3, 7), tile_types.bookshelf)
+    tiles = np.array(world_level.tiles)
+
+    build_level = world_map.build_level
+    monkeypatch.setattr(world_map, "build_level", lambda *key: pytest.fail("diff_level generated the level"))
+    diff = world_map.diff_level(world_level)
+    monkeypatch.setattr(world_map, "build_level", build_level)
+    world_map.restore_level(world_level, diff)
+    assert (np.array(world_level.tiles) == tiles).all()
+
+    #a restored level keeps diffing against the generated tiles, not the restored ones
+    monkeypatch.setattr(world_map, "build_level", lambda *key: pytest.fail("diff_level generated the level"))
+    world_level.set_tiles((4, 7), tile_types.bookshelf)
+    tiles[4, 7] = tile_types.bookshelf
+    diff = world_map.diff_level(world_level)
+    monkeypatch.setattr(world_map, "build_level", build_level)
+    world_map.restore_level(world_level, diff)
+    assert (np.array(world_level.tiles) == tiles).all()
+
+
+def test_shutdown_drops_background_builds(new_game):
+    engine = new_game()
+    world_map = engine.world_map
+    assert world_map.pregenerated_levels #new_game starts building where the stairs go
+    world_map.shutdown()
+    assert world_map.pregeneration_pool is None and not world_map.pregenerated_levels
+    world_map.generate_level("Library", 1) #built when entered instead
+    assert engine.world_level.level_name == "Library-1"
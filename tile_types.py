@@ -4,6 +4,8 @@ import numpy as np
 
 #tile_types definitions for tiles that make up the worldlevel
 #I would add things like water or transparent walls here
+#levels only store a uint8 tile id per tile, the id is the tiles row in tile_table
+#so walkable/transparent/graphics for a whole array of ids is just tile_table[field][ids]
 
 #Tile graphics structured type compatible with Console.tiles_rgb.
 graphic_dt = np.dtype(
@@ -25,15 +27,25 @@ tile_dt = np.dtype(
 )
 
 
+#registry of every tile type, indexed by tile id, new_tile adds to it
+tile_table = np.zeros(0, dtype=tile_dt)
+
+
 def new_tile(
     *,  # Enforce the use of keywords, so that parameter order doesn't matter.
     walkable: int,
     transparent: int,
     dark: Tuple[int, Tuple[int, int, int], Tuple[int, int, int]],
     light: Tuple[int, Tuple[int, int, int], Tuple[int, int, int]],
-) -> np.ndarray:
-    """Helper function for defining individual tile types """
-    return np.array((walkable, transparent, dark, light), dtype=tile_dt)
+) -> np.uint8:
+    """Helper function for defining individual tile types, returns the new tiles id """
+    global tile_table
+    if len(tile_table) > np.iinfo(np.uint8).max:
+        raise ValueError("too many tile types for a uint8 tile id")
+    tile = np.array([(walkable, transparent, dark, light)], dtype=tile_dt)
+    tile_table = np.concatenate([tile_table, tile])
+    #ids are given out in definition order, so new tiles go after the existing ones to keep old saves working
+    return np.uint8(len(tile_table) - 1)
 
 # SHROUD represents unexplored, unseen tiles
 SHROUD = np.array((ord(" "), (255, 255, 255), (0, 0, 0)), dtype=graphic_dt)
@@ -63,4 +75,11 @@ up_stairs = new_tile(
     light=(ord("<"), (255, 255, 255), (200, 180, 50)),
 )
 
+bookshelf = new_tile(
+    walkable=False,
+    transparent=False,
+    dark=(ord("="), (80, 50, 20), (0, 0, 0)),
+    light=(ord("="), (170, 110, 50), (0, 0, 0)),
+)
+
 #the concept of side stairs, connecting two levels of the same depth, is interesting
\ No newline at end of file
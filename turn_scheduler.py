@@ -0,0 +1,122 @@
+#energy based turn scheduling for npcs
+#
+#every actor gains its speed in energy each turn and acts whenever it has ACTION_COST energy,
+#so a speed 200 actor acts twice a turn and a speed 50 actor every other turn
+#instead of asking every actor each turn, actors wait in a priority queue keyed on the turn they next act
+#
+#only actors near the player are kept in the queue, anything further than ACTIVITY_RADIUS,
+#asleep or without an ai is parked: it keeps the turn its energy was last updated (energy_turn)
+#and when it is woken the actions it missed are handed to its ai in one fast_forward call
+#so a turn costs about the number of active actors nearby, not the number of actors on the level
+
+from __future__ import annotations
+
+import heapq
+import itertools
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import exceptions
+from movement_batch import MovementBatch
+
+if TYPE_CHECKING:
+    from entity import Actor
+    from engine import Engine
+    from world_level import WorldLevel
+
+#energy an action costs, an actor with speed ACTION_COST acts once a turn
+ACTION_COST = 100
+#actors further than this many tiles from the player are parked
+ACTIVITY_RADIUS = 20
+
+
+class TurnScheduler:
+    def __init__(self) -> None:
+        self.world_level: Optional[WorldLevel] = None #the level the queue belongs to
+        #(turn the actor next acts, insertion order, actor)
+        self.queue: List[Tuple[int, int, Actor]] = []
+        #insertion order of each queued actors live queue entry, older entries for it are skipped
+        self.scheduled: Dict[Actor, int] = {}
+        self.counter = itertools.count()
+
+    def reset(self, world_level: WorldLevel) -> None:
+        #Start over on a new level, the actors left behind keep their energy_turn and catch up when woken
+        self.world_level = world_level
+        self.queue.clear()
+        self.scheduled.clear()
+
+    def can_act(self, actor: Actor, engine: Engine) -> bool:
+        #Return True if actor should stay in the queue
+        player = engine.player
+        return (
+            getattr(actor, "parent", None) is self.world_level
+            and actor is not player
+            and actor.ai is not None
+            and not actor.asleep
+            and actor.speed > 0
+            and abs(actor.x - player.x) <= ACTIVITY_RADIUS
+            and abs(actor.y - player.y) <= ACTIVITY_RADIUS
+        )
+
+    def push(self, actor: Actor) -> None:
+        #Queue actor for the turn its energy reaches ACTION_COST
+        ready_turn = actor.energy_turn - (actor.energy - ACTION_COST) // actor.speed #ceil division
+        order = next(self.counter)
+        self.scheduled[actor] = order
+        heapq.heappush(self.queue, (ready_turn, order, actor))
+
+    def wake(self, actor: Actor, turn: int) -> None:
+        #Queue a parked actor, fast forwarding the actions it would have taken before this turn
+        if actor.energy_turn is None:
+            actor.energy_turn = turn - 1 #new actors start with no backlog
+        energy = actor.energy + (turn - 1 - actor.energy_turn) * actor.speed
+        missed_actions, actor.energy = divmod(energy, ACTION_COST)
+        actor.energy_turn = turn - 1
+        if missed_actions:
+            actor.ai.fast_forward(missed_actions)
+        self.push(actor)
+
+    def wake_nearby(self, engine: Engine) -> None:
+        #Wake every actor that can act and is within ACTIVITY_RADIUS of the player
+        components = self.world_level.components
+        actors = self.world_level.actors
+        for entity_id in components.ids_near(engine.player.x, engine.player.y, ACTIVITY_RADIUS):
+            actor = components.entities[entity_id]
+            if actor not in self.scheduled and actor in actors and self.can_act(actor, engine):
+                self.wake(actor, engine.turn)
+
+    def run(self, engine: Engine) -> None:
+        #Perform every npc action due by engine.turn
+        #actors can be added to or removed from the level by these actions, removed ones are dropped when reached
+        if engine.world_level is not self.world_level:
+            self.reset(engine.world_level)
+        self.wake_nearby(engine)
+
+        #ai moves are collected in a batch and applied together once every due actor has acted
+        batch = engine.movement_batch = MovementBatch(self.world_level)
+        try:
+            self.run_due_actors(engine)
+        finally:
+            engine.movement_batch = None
+            batch.resolve() #even if an ai raised, the moves already submitted still happen
+
+    def run_due_actors(self, engine: Engine) -> None:
+        turn = engine.turn
+        while self.queue and self.queue[0][0] <= turn:
+            _, order, actor = heapq.heappop(self.queue)
+            if self.scheduled.get(actor) != order:
+                continue #requeued since this entry was pushed
+            if not self.can_act(actor, engine):
+                del self.scheduled[actor] #park it, energy_turn remembers when
+                continue
+
+            actor.energy += (turn - actor.energy_turn) * actor.speed
+            actor.energy_turn = turn
+            try:
+                while actor.energy >= ACTION_COST and getattr(actor, "parent", None) is self.world_level:
+                    actor.energy -= ACTION_COST
+                    try:
+                        actor.ai.perform()
+                    except exceptions.Impossible:
+                        pass # ignore impossible actions from ai
+            finally:
+                self.push(actor) #requeue even if the ai raised, or it would never be woken again
@@ -1,136 +1,387 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, List, TYPE_CHECKING
+from collections import OrderedDict
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import random
+import shutil
+import tempfile
+import weakref
+from typing import Dict, Iterable, Iterator, Optional, List, Set, Tuple, TYPE_CHECKING
 import numpy as np
+import tcod.path
 from tcod.console import Console
 
-from entity import Actor, Item, Spell, Spellbook, Stair
+from entity import Actor, Entity, Item, Spell, Spellbook, Stair
+from chunked_array import ChunkedArray
+from entity_components.component_store import ComponentStore
+from fov_service import FovService
 import tile_types
 
 
 if TYPE_CHECKING:
+    from camera import Camera
     from engine import Engine
-    from entity import Entity, Actor
+    from save_archive import SaveArchive
 
 #world generation, and filling up the world with entities
 #worldlevel class, variables and methods dealing with a given level
 #worldmap class, variables and methods for the current world
 
 
+#worker threads used to build stair destination levels in the background
+PREGENERATION_WORKERS = 2
+
+#entity types that get their own registry on each WorldLevel, checked in order
+REGISTERED_TYPES = (Actor, Item, Spell, Spellbook, Stair, Entity)
+
+#how far from its origin compute_distance_map looks by default, further than the scheduler wakes actors
+DISTANCE_MAP_RADIUS = 32
+#more dirty regions than this before a render are replaced by one covering the whole level
+MAX_DIRTY_REGIONS = 64
+
+
+def intersect_bounds(a: Tuple[slice, slice], b: Tuple[slice, slice]) -> Optional[Tuple[slice, slice]]:
+    #Return the overlap of two boxes, None if they dont overlap
+    x0, x1 = max(a[0].start, b[0].start), min(a[0].stop, b[0].stop)
+    y0, y1 = max(a[1].start, b[1].start), min(a[1].stop, b[1].stop)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return slice(x0, x1), slice(y0, y1)
+
+
+def offset_bounds(inner: Tuple[slice, slice], outer: Tuple[slice, slice]) -> Tuple[slice, slice]:
+    #Return inner relative to the top left of outer
+    return (
+        slice(inner[0].start - outer[0].start, inner[0].stop - outer[0].start),
+        slice(inner[1].start - outer[1].start, inner[1].stop - outer[1].start),
+    )
+
+
 class WorldLevel: #functions as gamemap
     def __init__(
         self, engine: Engine, width: int, height: int, entities: Iterable[Entity] = ()
     ):
         self.engine = engine
         self.width, self.height = width, height
-        self.entities = set(entities)
-        self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
+        self.entities: Set[Entity] = set()
+        #type partitioned registries, kept up to date by add_entity and remove_entity
+        #entities that arent one of the registered types go in the Entity registry
+        self.registries: Dict[type, Set[Entity]] = {
+            entity_type: set() for entity_type in REGISTERED_TYPES
+        }
+        #spatial index of entities on this level, keyed by (x, y)
+        #entity_locations remembers where each entity was indexed, so it can be found again after its x/y changes
+        self.entity_index: Dict[Tuple[int, int], List[Entity]] = {}
+        self.entity_locations: Dict[Entity, Tuple[int, int]] = {}
+        #struct of arrays copy of the entities state, see ComponentStore
+        self.components = ComponentStore()
+        #number of movement blocking entities on each tile, kept up to date with the spatial index
+        #the per tile arrays are chunked and only allocated where they differ from their fill, see ChunkedArray
+        self.occupancy = ChunkedArray((width, height), np.int32, 0)
+        for entity in entities:
+            self.add_entity(entity)
+        #tile ids, what each id is comes from tile_types.tile_table, see tile_mask
+        self.tiles = ChunkedArray((width, height), np.uint8, tile_types.wall)
+        #walkable/transparent masks looked up from tiles, rebuilt when transparency_version changes
+        self.tile_masks: Dict[str, ChunkedArray] = {}
+        self.tile_masks_version = -1
 
         self.branchdepth=int(0)
         self.branch=str("<Unnamed>")
         
         
-        self.visible = np.full(
-            (width, height), fill_value=False, order="F"
-        ) #Tiles the player can currently see
-        self.explored = np.full(
-            (width, height), fill_value=False, order="F"
-        ) #tiles the player has seen before
+        self.visible = ChunkedArray((width, height), bool, False) #Tiles the player can currently see
+        self.explored = ChunkedArray((width, height), bool, False) #tiles the player has seen before
+
+        #composed light/dark/SHROUD graphics for the part of the level last drawn (view_bounds)
+        #while the camera stays put only the dirty regions inside it are recomposed on render
+        self.view_layer: Optional[np.ndarray] = None
+        self.view_bounds: Optional[Tuple[slice, slice]] = None
+        self.dirty_regions: List[Tuple[slice, slice]] = []
+
+        #bumped whenever tiles change, so cached fov results know when they are stale
+        self.transparency_version = 0
+        self.generated_version = 0 #transparency_version when generation finished, set by WorldMap.build_level
+        #tiles as they were generated, copied on the first change after generation so diffs dont need procgen
+        self.generated_tiles: Optional[ChunkedArray] = None
+        #fov for the player, monsters and sight sources, with its own cache of recent results
+        self.fov = FovService(self)
+        self.fov_key: Optional[Tuple] = None #what the fov currently in visible was computed from, see Engine.update_fov
+        self.fov_bounds: List[Tuple[slice, slice]] = [] #the boxes visible was set in
 
         #self.downstairs_location = (0,0)
         #Ill need to rework the stair functionality to support
         #multiple downstair and upstair, as well as different destinations
     
+    def __getstate__(self) -> dict:
+        #the view layer, tile masks, the component store and occupancy are rebuilt after loading instead of being saved
+        state = self.__dict__.copy()
+        del state["components"], state["occupancy"]
+        state["tile_masks"] = {}
+        state["tile_masks_version"] = -1
+        state["view_layer"] = state["view_bounds"] = None
+        state["dirty_regions"] = []
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.components = ComponentStore()
+        for entity in self.entities:
+            self.components.add(entity)
+        self.occupancy = ChunkedArray((self.width, self.height), np.int32, 0)
+        self.occupancy.add_at(self.components.blocking_locations(), 1)
+
     @property
     def worldlevel(self) -> WorldLevel:
         return self
     
     @property
-    def actors(self) -> Iterator[Actor]:
-        #Iterate over this levels living actors
-        yield from (
-            entity
-            for entity in self.entities
-            if isinstance(entity, Actor) #and entity.is_alive
-        )
+    def actors(self) -> Set[Actor]:
+        #This levels actors, the returned set should not be modified
+        return self.registries[Actor]
+
+    @property
+    def items(self) -> Set[Item]:
+        return self.registries[Item]
+
+    @property
+    def spells(self) -> Set[Spell]:
+        return self.registries[Spell]
+
+    @property
+    def spellbooks(self) -> Set[Spellbook]:
+        return self.registries[Spellbook]
+
+    @property
+    def stairs(self) -> Set[Stair]:
+        return self.registries[Stair]
 
     @property
     def nonactors(self) -> Iterator[Entity]:
         #presumably this also does not grab corpses, do I even want corpses?
         #hopefully this is more useful than the items iterator method since I added nonitem nonactor types (spells+spellbooks)
-        yield from (
-            entity
-            for entity in self.entities
-            if not isinstance(entity, Actor)
-        )
+        for entity_type, registry in self.registries.items():
+            if entity_type is not Actor:
+                yield from registry
 
-    @property
-    def stairs(self) -> Iterator[Stair]:
-        #Iterate over this levels stairs
-        yield from (
-            entity
-            for entity in self.entities
-            if isinstance(entity, Stair)
-        )
+    def registry_for(self, entity: Entity) -> Set[Entity]:
+        #Return the registry an entity belongs in
+        for entity_type in REGISTERED_TYPES:
+            if isinstance(entity, entity_type):
+                return self.registries[entity_type]
+
+    def add_entity(self, entity: Entity) -> None:
+        #Add an entity to this level and index it at its current location
+        #if the entity is already on this level it is just re-indexed
+        if entity in self.entity_locations:
+            self.update_entity_location(entity)
+            return
+        self.entities.add(entity)
+        self.registry_for(entity).add(entity)
+        location = (entity.x, entity.y)
+        self.entity_locations[entity] = location
+        self.entity_index.setdefault(location, []).append(entity)
+        self.components.add(entity)
+        if entity.blocks_movement:
+            self.occupancy[location] += 1
 
+    def remove_entity(self, entity: Entity) -> None:
+        #Remove an entity from this level and from the spatial index
+        location = self.entity_locations.pop(entity)
+        self.entities.remove(entity)
+        self.registry_for(entity).remove(entity)
+        self._unindex(entity, location)
+        self.components.remove(entity)
+        if entity.blocks_movement:
+            self.occupancy[location] -= 1
 
+    def update_entity_location(self, entity: Entity) -> None:
+        #Move an entity to its current x, y in the spatial index, call after changing an entities position
+        old_location = self.entity_locations[entity]
+        new_location = (entity.x, entity.y)
+        if old_location == new_location:
+            return
+        self.move_in_index(entity, old_location, new_location)
+        if entity.blocks_movement:
+            self.occupancy[old_location] -= 1
+            self.occupancy[new_location] += 1
+
+    def move_in_index(self, entity: Entity, old_location: Tuple[int, int], new_location: Tuple[int, int]) -> None:
+        #Move an entity between spatial index entries without touching occupancy
+        #MovementBatch updates occupancy for a whole batch of moves at once and then calls this for each
+        self._unindex(entity, old_location)
+        self.entity_locations[entity] = new_location
+        self.entity_index.setdefault(new_location, []).append(entity)
+
+    def _unindex(self, entity: Entity, location: Tuple[int, int]) -> None:
+        entities_here = self.entity_index[location]
+        entities_here.remove(entity)
+        if not entities_here:
+            del self.entity_index[location] #keep the index from filling up with empty lists
+
+    def get_entities_at_location(self, x: int, y: int) -> List[Entity]:
+        #Return the entities at the given location, the returned list should not be modified
+        return self.entity_index.get((x, y), [])
 
     def get_blocking_entity_at_location(
         self, location_x: int, location_y: int,
     ) -> Optional[Entity]:
-        for entity in self.entities:
-            if (
-                entity.blocks_movement
-                and entity.x == location_x
-                and entity.y == location_y
-            ):
+        if not self.occupancy[location_x, location_y]:
+            return None
+        for entity in self.get_entities_at_location(location_x, location_y):
+            if entity.blocks_movement:
                 return entity
         return None
 
     def get_actor_at_location(self, x: int, y: int) -> Optional[Actor]:
-        for actor in self.actors:
-            if actor.x == x and actor.y == y:
-                return actor
+        for entity in self.get_entities_at_location(x, y):
+            if isinstance(entity, Actor):
+                return entity
         return None
     
     def get_stair_at_location(self, x: int, y: int) -> Optional[Stair]:
-        for stair in self.stairs:
-            if stair.x == x and stair.y == y:
-                return stair
+        for entity in self.get_entities_at_location(x, y):
+            if isinstance(entity, Stair):
+                return entity
         return None
 
+    @property
+    def walkable(self) -> ChunkedArray:
+        return self.tile_mask("walkable")
+
+    @property
+    def transparent(self) -> ChunkedArray:
+        return self.tile_mask("transparent")
+
+    def tile_mask(self, field: str) -> ChunkedArray:
+        #Return a field of tile_types.tile_table for every tile, cached until the tiles change
+        if self.tile_masks_version != self.transparency_version:
+            self.tile_masks.clear()
+            self.tile_masks_version = self.transparency_version
+        mask = self.tile_masks.get(field)
+        if mask is None:
+            mask = self.tile_masks[field] = self.tiles.map(tile_types.tile_table[field])
+        return mask
+
+    def set_tiles(self, index, tile: int) -> None:
+        #Change the tiles at index, use this instead of writing to tiles directly once a level is in play
+        if self.generated_tiles is None and self.transparency_version == self.generated_version:
+            self.generated_tiles = self.tiles.copy()
+        self.tiles[index] = tile
+        self.transparency_version += 1
+        if self.tile_masks_version == self.transparency_version - 1:
+            #the cached masks only need the same tiles changed, not a rebuild
+            for field, mask in self.tile_masks.items():
+                mask[index] = tile_types.tile_table[field][tile]
+            self.tile_masks_version = self.transparency_version
+        if (
+            isinstance(index, tuple)
+            and len(index) == 2
+            and all(isinstance(i, (int, slice)) for i in index)
+        ):
+            self.mark_dirty(tuple(
+                i if isinstance(i, slice) else slice(i, i + 1) for i in index
+            ))
+        else:
+            self.mark_dirty((slice(0, self.width), slice(0, self.height)))
+
+    def mark_dirty(self, bounds: Tuple[slice, slice]) -> None:
+        #Mark a region of the view layer to be recomposed on the next render
+        if len(self.dirty_regions) >= MAX_DIRTY_REGIONS:
+            #nothing has been drawn in a while, one region covering the whole level is just as good
+            self.dirty_regions = [(slice(0, self.width), slice(0, self.height))]
+        else:
+            self.dirty_regions.append(bounds)
+
+    def window(self, x: int, y: int, radius: int) -> Tuple[slice, slice]:
+        #Return the box within radius of x, y clipped to the level
+        return (
+            slice(max(x - radius, 0), min(x + radius + 1, self.width)),
+            slice(max(y - radius, 0), min(y + radius + 1, self.height)),
+        )
+
+    def movement_cost(self, bounds: Tuple[slice, slice]) -> np.ndarray:
+        #Return the cost of walking onto each tile inside bounds, 0 for tiles that cant be walked on
+        #blocking entities add to the cost instead of blocking completely, so ai can path around them
+        #a lower number means more enemies will crowd behind each other in hallways
+        #a higher number means enemies will take longer paths in order to surround the player
+        cost = self.walkable[bounds].astype(np.int8)
+        cost[(self.occupancy[bounds] > 0) & (cost > 0)] += 10
+        return cost
+
+    def compute_distance_map(
+        self, x: int, y: int, radius: int = DISTANCE_MAP_RADIUS,
+    ) -> Tuple[Tuple[slice, slice], np.ndarray]:
+        #Return the box within radius of (x, y) and the walking distance from every tile in it to (x, y)
+        #using a single dijkstra pass, unreachable tiles are left at the max value of the array
+        bounds = self.window(x, y, radius)
+        cost = self.movement_cost(bounds)
+        distance = tcod.path.maxarray(cost.shape, dtype=np.int32, order="F")
+        distance[x - bounds[0].start, y - bounds[1].start] = 0
+        tcod.path.dijkstra2d(distance, cost, cardinal=2, diagonal=3, out=distance)
+        return bounds, distance
+
     def in_bounds(self, x: int, y: int) -> bool:
         #Return True if x and y are inside of the bounds of this level
         return 0 <= x < self.width and 0 <= y < self.height
     
-    def render(self, console: Console) -> None:
+    def compose(self, bounds: Tuple[slice, slice]) -> np.ndarray:
+        #Return the graphics for the tiles inside bounds
+        tiles = tile_types.tile_table[self.tiles[bounds]]
+        return np.select(
+            condlist=[self.visible[bounds], self.explored[bounds]],
+            choicelist=[tiles["light"], tiles["dark"]],
+            default=tile_types.SHROUD,
+        )
+
+    def render(self, console: Console, camera: Camera) -> None:
         #Renders the level
         #if a tile is in the "visible" array, then draw it with "light" colors
         #if it is not visible but explored, then draw with "dark" colors
         #if not visible and not explored, then default to "SHROUD"
         #It is strange for this to be in the procgen file and not the engine file
         #but it might still belong here
-        console.tiles_rgb[0 : self.width, 0 : self.height] = np.select(
-            condlist=[self.visible, self.explored],
-            choicelist=[self.tiles["light"], self.tiles["dark"]],
-            default=tile_types.SHROUD,
-        )
+        #only the part of the level inside the camera is drawn, to the top left of the console
+        #while the camera stays put only the dirty regions are recomposed, the rest is reused from view_layer
+        bounds = camera.bounds(self.width, self.height)
+        if bounds != self.view_bounds:
+            self.view_layer = self.compose(bounds)
+            self.view_bounds = bounds
+        else:
+            for region in self.dirty_regions:
+                overlap = intersect_bounds(region, bounds)
+                if overlap:
+                    self.view_layer[offset_bounds(overlap, bounds)] = self.compose(overlap)
+        self.dirty_regions.clear()
+        console.tiles_rgb[0 : self.view_layer.shape[0], 0 : self.view_layer.shape[1]] = self.view_layer
 
-        entities_sorted_for_rendering = sorted(
-            self.entities, key=lambda x: x.render_order.value
-        )
+        self.render_entities(console, bounds)
 
-        for entity in entities_sorted_for_rendering:
-            if self.visible[entity.x, entity.y]:
-                console.print(
-                    x=entity.x, y=entity.y, string=entity.char, fg=entity.color
-                )
+    def render_entities(self, console: Console, bounds: Tuple[slice, slice]) -> None:
+        #Draw every visible entity inside bounds, where entities share a tile the highest render order is drawn
+        components = self.components
+        drawn = components.ids_in_box(bounds)
+        drawn = drawn[self.visible[components.x[drawn], components.y[drawn]]]
+        if not len(drawn):
+            return
 
-    #store this world_level in world_level_instances
+        #sort by render order, then keep the last entity of each tile
+        x, y = components.x, components.y
+        drawn = drawn[np.argsort(components.render_order[drawn], kind="stable")][::-1]
+        _, top_index = np.unique(x[drawn] * self.height + y[drawn], return_index=True)
+        drawn = drawn[top_index]
+
+        screen_x, screen_y = x[drawn] - bounds[0].start, y[drawn] - bounds[1].start
+        console.tiles_rgb["ch"][screen_x, screen_y] = components.ch[drawn]
+        console.tiles_rgb["fg"][screen_x, screen_y] = components.fg[drawn]
+
+    #store this world_level in world_levels
     #need to rework this so it works, and doesnt use level_name
     def store_world_level(self, level_name):
         self.level_name = level_name
-        WorldMap.world_level_instances.append(self)
+        self.engine.world_map.add_world_level(self)
 
 
 
@@ -146,7 +397,10 @@ class WorldMap: #functions as gameworld
         level_height: int,
         branch: str = "<Unknown>",
         branchdepth: int = 0,
-        world_level_instances: List[WorldLevel]
+        world_level_instances: Iterable[WorldLevel] = (),
+        max_resident_levels: Optional[int] = 8,
+        world_seed: Optional[int] = None,
+        store_level_diffs: bool = True,
     ):
         self.engine=engine
         self.level_width=level_width
@@ -154,40 +408,208 @@ class WorldMap: #functions as gameworld
 
         self.branch = branch
         self.branchdepth=branchdepth
-        self.world_level_instances=world_level_instances
-    
-    def get_world_level(self, branch, branchdepth) -> WorldLevel:
-        if [level for level in self.world_level_instances if level.branch == branch and level.branchdepth == branchdepth]:
-            return WorldLevel
+        #every level is generated from a seed derived from this, so a level can always be generated again
+        self.world_seed = random.getrandbits(64) if world_seed is None else world_seed
+        #if True, levels that are out of memory or saved are kept as the changes since they were generated
+        #instead of in full, and regenerated from their seed when needed
+        self.store_level_diffs = store_level_diffs
+        #every level in this world keyed by (branch, branchdepth), least recently visited first
+        self.world_levels: OrderedDict[Tuple[str, int], WorldLevel] = OrderedDict(
+            ((level.branch, level.branchdepth), level) for level in world_level_instances
+        )
+        #how many levels are kept in memory at once, None for no limit
+        #the least recently visited levels past this are spilled to disk and loaded again when visited
+        self.max_resident_levels = max_resident_levels
+        #levels that arent in memory, and the (archive, chunk name) they can be loaded from
+        self.level_sources: Dict[Tuple[str, int], Tuple[SaveArchive, str]] = {}
+        #levels that arent in memory, and their diffs, see diff_level
+        self.level_diffs: Dict[Tuple[str, int], dict] = {}
+        self.spill_directory: Optional[str] = None
+        #levels being built in the background, keyed by (branch, branchdepth)
+        self.pregenerated_levels: Dict[Tuple[str, int], Future] = {}
+        self.pregeneration_pool: Optional[ThreadPoolExecutor] = None
 
-    def generate_level(self, branch: str, branchdepth: int) -> None:
+    def __getstate__(self) -> dict:
+        #level sources, diffs, spill files and pregenerated levels only exist for this session
+        #save_archive handles level sources and diffs while saving, pregenerated levels are just built again
+        state = self.__dict__.copy()
+        state["level_sources"] = {}
+        state["level_diffs"] = {}
+        state["spill_directory"] = None
+        state["pregenerated_levels"] = {}
+        state["pregeneration_pool"] = None
+        return state
+
+    def get_world_level(self, branch, branchdepth) -> Optional[WorldLevel]:
+        level = self.world_levels.get((branch, branchdepth))
+        if level:
+            self.make_resident(level)
+        return level
+
+    def is_resident(self, level: WorldLevel) -> bool:
+        key = (level.branch, level.branchdepth)
+        return key not in self.level_sources and key not in self.level_diffs
+
+    def make_resident(self, level: WorldLevel) -> None:
+        #Load a level back into memory if it isnt, and mark it as the most recently visited
+        import save_archive
+
+        key = (level.branch, level.branchdepth)
+        if key in self.level_sources:
+            archive, name = self.level_sources.pop(key)
+            save_archive.load_level(archive, name, level, self.engine, self.world_levels)
+        elif key in self.level_diffs:
+            self.restore_level(level, self.level_diffs.pop(key))
+        self.world_levels.move_to_end(key)
+        self.evict_levels(keep=level)
+
+    def add_world_level(self, level: WorldLevel) -> None:
+        self.world_levels[(level.branch, level.branchdepth)] = level
+        self.evict_levels(keep=level)
+
+    def evict_levels(self, keep: Optional[WorldLevel] = None) -> None:
+        #Spill the least recently visited levels until the residency budget is met
+        #the levels the engine and the player are on, and keep, are never spilled
+        if self.max_resident_levels is None:
+            return
+        resident = len(self.world_levels) - len(self.level_sources) - len(self.level_diffs)
+        if resident <= self.max_resident_levels:
+            return
+        protected = {self.engine.world_level, getattr(self.engine.player, "parent", None), keep}
+        for level in list(self.world_levels.values()):
+            if resident <= self.max_resident_levels:
+                return
+            if level not in protected and self.is_resident(level):
+                self.spill_level(level)
+                resident -= 1
+
+    def spill_level(self, level: WorldLevel) -> None:
+        #Move a level out of memory and empty it, leaving only what is needed to find it again
+        #the level is kept as its diff if store_level_diffs is set, otherwise it is written to a spill file
+        import save_archive
+
+        key = (level.branch, level.branchdepth)
+        if self.store_level_diffs:
+            self.level_diffs[key] = self.diff_level(level)
+            level.__dict__.clear()
+            level.branch, level.branchdepth = key
+            return
+
+        if not self.spill_directory:
+            self.spill_directory = tempfile.mkdtemp(prefix="rogue_bibliomancy_")
+            weakref.finalize(self, shutil.rmtree, self.spill_directory, True)
+
+        name = save_archive.level_chunk_name(*key)
+        #a new file for every spill, the last one may still be mapped by arrays loaded from it
+        #or read by a background save, old spill files are removed with the spill directory
+        spill_file, filename = tempfile.mkstemp(
+            suffix=".spill", prefix=f"{name.replace(':', '_')}_", dir=self.spill_directory
+        )
+        os.close(spill_file)
+        self.level_sources[key] = save_archive.spill_level(level, self.engine, filename), name
+
+        level.__dict__.clear()
+        level.branch, level.branchdepth = key
+
+    def build_level(self, branch: str, branchdepth: int) -> WorldLevel:
+        #Generate a new level without adding it to this map
+        #safe to run on a worker thread, it doesnt touch the engine or any existing level
         import procgen
         #import engine
 
-        self.branch = branch
-        self.branchdepth = branchdepth
-
         #have this method accept the destination branch and level
         #apparently using reflection in this way is a bad idea
-        #so, use a dict mapping instead of reflection?
+        #so, use a dict mapping instead of reflection? procgen.BRANCHES is that mapping
+
+        level = procgen.BRANCHES[branch](branchdepth).generate_level(
+            branchdepth=branchdepth,
+            level_width=self.level_width,
+            level_height=self.level_height,
+            engine=self.engine,
+            seed=self.level_seed(branch, branchdepth),
+            )
+        level.branch = branch
+        level.branchdepth = branchdepth
+        level.generated_version = level.transparency_version
+        level.generated_tiles = None #copied by the first set_tiles of procgen itself, which isnt a change
+        return level
+
+    def level_seed(self, branch: str, branchdepth: int) -> int:
+        #Return the seed a level is generated from, the same world seed always gives the same level seeds
+        digest = hashlib.sha256(f"{self.world_seed}:{branch}:{branchdepth}".encode()).digest()
+        return int.from_bytes(digest[:8], "little")
 
-        branches = {
-            'Library': procgen.Library.generate_level,
-            'Entrance': procgen.Entrance.generate_level,
+    def diff_level(self, level: WorldLevel) -> dict:
+        #Return the changes to a level since it was generated, restore_level turns this back into the level
+        #entities are kept whole, the diff is their current state not how they got there
+        diff = {
+            "level_diff": True,
+            "explored": dict(level.explored.chunks), #only the chunks that have been explored
+            "entities": list(level.entities),
+            "tile_changes": None,
+            "sight_sources": dict(level.fov.sight_sources),
         }
-        #maybe move the branches dict to somewhere else that makes more sense?
+        if level.transparency_version != level.generated_version:
+            #tiles changed since generation, generated_tiles has them from before the first change
+            diff["tile_changes"] = level.tiles.changed_chunks(level.generated_tiles)
+        return diff
+
+    def restore_level(self, level: WorldLevel, diff: dict) -> None:
+        #Fill in a level shell by generating it again and applying a diff from diff_level
+        base = self.build_level(level.branch, level.branchdepth)
+        level.__setstate__(base.__getstate__())
+        #the copied fov service still belongs to base, the level needs its own
+        level.fov = FovService(level)
+        level.fov.sight_sources.update(diff.get("sight_sources", {}))
+        for entity in list(level.entities):
+            level.remove_entity(entity) #generated entities are replaced by the ones in the diff
+
+        if diff["tile_changes"]:
+            level.generated_tiles = level.tiles.copy()
+            level.tiles.update_chunks(diff["tile_changes"])
+            level.transparency_version += 1
+        level.explored.update_chunks(diff["explored"])
+        for entity in diff["entities"]:
+            level.add_entity(entity)
+
+    def generate_level(self, branch: str, branchdepth: int) -> None:
+        self.branch = branch
+        self.branchdepth = branchdepth
 
         level_name=f"{branch}-{branchdepth}"
 
         if WorldMap.get_world_level(self, branch, branchdepth): #test if a world_level with the correct branch+branchdepth already exists
             #if a world_level already exists, just return
             return
+
+        future = self.pregenerated_levels.pop((branch, branchdepth), None)
+        if future:
+            #already built in the background, waits if it is still being built
+            self.engine.world_level = future.result()
         else:
-            self.engine.world_level = branches[branch](
-                self,
-                branchdepth=self.branchdepth,
-                level_width=self.level_width,
-                level_height=self.level_height,
-                engine=self.engine
+            self.engine.world_level = self.build_level(branch, branchdepth)
+        self.add_world_level(self.engine.world_level)
+
+    def pregenerate_stair_destinations(self, level: WorldLevel) -> None:
+        #Start building the levels the stairs on level lead to, if they dont exist yet
+        #so taking the stairs can swap in a level that is already built
+        #the pool is threads since generated levels refer to the engine, generation overlaps with waiting for input
+        for stair in level.stairs:
+            key = (stair.dest_branch, stair.dest_branchdepth)
+            if key in self.world_levels or key in self.pregenerated_levels:
+                continue
+            if not self.pregeneration_pool:
+                self.pregeneration_pool = ThreadPoolExecutor(
+                    max_workers=PREGENERATION_WORKERS, thread_name_prefix="pregenerate"
                 )
+            self.pregenerated_levels[key] = self.pregeneration_pool.submit(
+                self.build_level, *key
+            )
 
+    def shutdown(self) -> None:
+        #Stop building levels in the background, waiting for the ones already being built
+        #the dropped levels are built when they are entered instead, like levels that were never pregenerated
+        if self.pregeneration_pool:
+            self.pregeneration_pool.shutdown(wait=True, cancel_futures=True)
+            self.pregeneration_pool = None
+        self.pregenerated_levels.clear()